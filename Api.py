@@ -0,0 +1,108 @@
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from Clients import get_db, warm_up
+from Profile import start_profile_watcher
+from Indexes import ensure_indexes
+from Memory_Maintenance import start_memory_compaction
+from Metrics import registry
+from Service import ChatService, SessionNotFound, LONG_TERM_MEMORY
+
+# Run with: uvicorn Api:app --host 0.0.0.0 --port 8000 [--workers N]
+# Session state is stored in MongoDB (Chat_sessions), so any worker can serve any turn without
+# sticky routing. A client must still send a session's turns one at a time.
+# Memory compaction runs separately, as one scheduled `python Memory_Maintenance.py` job.
+
+class SessionRequest(BaseModel):
+    user_name: str
+    character_name: str
+    long_term_memory: bool = LONG_TERM_MEMORY
+
+class MessageRequest(BaseModel):
+    message: str
+    stream: bool = False
+
+service = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global service
+    # Test the connection once per worker; raises if MongoDB is unreachable
+    warm_up()
+    db = get_db()
+    start_profile_watcher(db)
+    ensure_indexes(db)
+    start_memory_compaction(db)
+    service = ChatService(db)
+    yield
+
+app = FastAPI(title="Character Chat API", lifespan=lifespan)
+
+def _session(session_id: str):
+    try:
+        return service.get_session(session_id)
+    except SessionNotFound:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+
+@app.get("/health")
+def health():
+    return {"status": "ok"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return registry.render()
+
+@app.get("/characters/{character_name}")
+def get_character(character_name: str):
+    character = service.get_character(character_name)
+    if character is None:
+        raise HTTPException(status_code=404, detail="Character not found")
+    return character
+
+@app.post("/sessions", status_code=201)
+def create_session(request: SessionRequest):
+    try:
+        session = service.create_session(request.user_name, request.character_name, request.long_term_memory)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return session.to_dict()
+
+@app.get("/sessions/{session_id}")
+def get_session(session_id: str):
+    return _session(session_id).to_dict()
+
+@app.delete("/sessions/{session_id}", status_code=204)
+def close_session(session_id: str):
+    service.close_session(session_id)
+
+@app.post("/sessions/{session_id}/messages")
+async def send_message(session_id: str, request: MessageRequest):
+    """
+    Send a user message. Returns the reply as JSON, or with stream=true as
+    newline-delimited JSON events: tokens as they are generated, then a final "done" event.
+    """
+    session = await asyncio.to_thread(_session, session_id)
+    if not request.stream:
+        try:
+            return await service.reply(session, request.message)
+        except LookupError as e:
+            # Profile missing or MongoDB too slow to serve it
+            raise HTTPException(status_code=503, detail=str(e))
+
+    async def events():
+        try:
+            async for event in service.reply_stream(session, request.message):
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            print(f"Error generating reply: {str(e)}")
+            yield json.dumps({"type": "error", "detail": str(e)}) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("Api:app", host=os.environ.get('API_HOST', "0.0.0.0"), port=int(os.environ.get('API_PORT', 8000)))
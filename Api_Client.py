@@ -0,0 +1,78 @@
+import json
+import os
+from typing import Dict, Iterator, Optional
+import requests
+
+# Address of the chat service (Api.py)
+CHAT_API_URL = os.environ.get('CHAT_API_URL', "http://localhost:8000")
+CHAT_API_TIMEOUT = float(os.environ.get('CHAT_API_TIMEOUT', 120))
+
+class ChatApiClient:
+    """
+    Blocking client for the chat service HTTP API, for UIs and scripts.
+    """
+
+    def __init__(self, base_url: str = CHAT_API_URL, timeout: float = CHAT_API_TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._http = requests.Session()
+
+    def _url(self, path: str) -> str:
+        return f"{self.base_url}{path}"
+
+    def get_character(self, character_name: str) -> Optional[Dict]:
+        response = self._http.get(self._url(f"/characters/{character_name}"), timeout=self.timeout)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    def create_session(self, user_name: str, character_name: str, long_term_memory: Optional[bool] = None) -> Dict:
+        payload = {"user_name": user_name, "character_name": character_name}
+        if long_term_memory is not None:
+            payload["long_term_memory"] = long_term_memory
+        response = self._http.post(self._url("/sessions"), json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def get_session(self, session_id: str) -> Optional[Dict]:
+        response = self._http.get(self._url(f"/sessions/{session_id}"), timeout=self.timeout)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    def close_session(self, session_id: str) -> None:
+        self._http.delete(self._url(f"/sessions/{session_id}"), timeout=self.timeout)
+
+    def send(self, session_id: str, message: str) -> Dict:
+        """
+        Send a message and return {"response", "emotion", "cached"}.
+        """
+        response = self._http.post(
+            self._url(f"/sessions/{session_id}/messages"),
+            json={"message": message},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def stream(self, session_id: str, message: str) -> Iterator[Dict]:
+        """
+        Send a message and yield the service's events: {"type": "token", "text"} as the
+        reply is generated, then {"type": "done", ...}. Raises on an "error" event.
+        """
+        with self._http.post(
+            self._url(f"/sessions/{session_id}/messages"),
+            json={"message": message, "stream": True},
+            timeout=self.timeout,
+            stream=True
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if event.get("type") == "error":
+                    raise RuntimeError(event.get("detail", "Chat service error"))
+                yield event
@@ -0,0 +1,56 @@
+from typing import Dict
+from Clients import get_db, get_chat_client
+from Buckets import bucket_update
+from Memory_Test import classify_messages_batch, make_memory
+from Vector_Memory import add_memory_vectors
+
+def backfill_long_term_memory(db, chat_client) -> Dict[str, int]:
+    """
+    Classify user messages in Short_term_memo that were never checked for importance
+    and store the important ones in Long_term_memo with their vectors. Messages are
+    classified in batch calls and flagged afterwards, so the job can be re-run safely.
+    """
+    Short_term = db['Short_term_memo']
+    Long_term = db['Long_term_memo']
+    stats = {"classified": 0, "stored": 0}
+
+    for bucket in Short_term.find({}, {"user_name": 1, "character_name": 1, "messages": 1}):
+        user_name = bucket.get('user_name')
+        character_name = bucket.get('character_name')
+
+        # Positions of user messages not yet classified (appends never shift them)
+        todo = [
+            i for i, msg in enumerate(bucket.get('messages', []))
+            if isinstance(msg, dict) and msg.get('role') == 'user'
+            and isinstance(msg.get('content'), str) and not msg.get('classified')
+        ]
+        if not todo:
+            continue
+
+        contents = [bucket['messages'][i]['content'] for i in todo]
+        decisions = classify_messages_batch(contents, chat_client)
+        memories = [make_memory(content) for content, is_important in zip(contents, decisions) if is_important]
+
+        if memories:
+            Long_term.update_one(*bucket_update(user_name, character_name, memories), upsert=True)
+            try:
+                add_memory_vectors(db, [
+                    {**memory, "user_name": user_name, "character_name": character_name}
+                    for memory in memories
+                ])
+            except Exception as e:
+                print(f"Error embedding memories: {str(e)}")
+
+        Short_term.update_one(
+            {"_id": bucket['_id']},
+            {"$set": {f"messages.{i}.classified": True for i in todo}}
+        )
+        stats["classified"] += len(todo)
+        stats["stored"] += len(memories)
+        print(f"{user_name} / {character_name}: {len(memories)} of {len(todo)} messages stored")
+
+    return stats
+
+if __name__ == "__main__":
+    stats = backfill_long_term_memory(get_db(), get_chat_client())
+    print(f"Classified {stats['classified']} messages, stored {stats['stored']} long-term memories")
@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List
+import numpy as np
+from Fake_LLM_Server import start_fake_llm_server
+
+CHARACTER_PROFILES = [
+    {
+        "Name": "Emily Turner",
+        "Traits": "Warm, organized and quietly ambitious; a marketing manager who loves hiking and jazz.",
+        "Summary": "Emily is 32, grew up in Portland, works at a design agency in Seattle and has a rescue dog named Max."
+    },
+    {
+        "Name": "Sarah Taylor",
+        "Traits": "Patient, witty and curious; a high school history teacher who bakes on weekends.",
+        "Summary": "Sarah is 41, lives in Boston with her two kids and is writing a book about local history."
+    }
+]
+
+USER_MESSAGES = [
+    "hi",
+    "How are you today?",
+    "I just started a new job as a nurse at the children's hospital.",
+    "What did you do this weekend?",
+    "My sister is getting married next month and I'm nervous about my speech.",
+    "lol that's funny",
+    "Do you have any advice for staying motivated?",
+    "I love hiking too, I went up Mount Rainier last summer.",
+    "ok",
+    "Tell me about your work."
+]
+
+STAGES = ["get_traits", "get_emotion", "get_relevant_memories", "generate_response",
+          "save_conversation_to_mongodb", "turn"]
+
+class StageTimer:
+    """
+    Thread-safe collection of per-stage durations.
+    """
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            with self._lock:
+                self.errors[name] = self.errors.get(name, 0) + 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.samples.setdefault(name, []).append(elapsed)
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    values = np.asarray(samples) * 1000
+    return {
+        "count": len(values),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p90_ms": float(np.percentile(values, 90)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max())
+    }
+
+def _bulk_write_one_by_one(collection, requests, ordered: bool = True, **kwargs) -> None:
+    # mongomock's bulk builder rejects the sort option pymongo 4.x UpdateOne passes along;
+    # the app only bulk-writes UpdateOne, so apply each one with update_one
+    from pymongo import UpdateOne
+    for request in requests:
+        if not isinstance(request, UpdateOne):
+            raise TypeError(f"Unsupported bulk operation for the MongoDB stand-in: {type(request).__name__}")
+        collection.update_one(request._filter, request._doc, upsert=request._upsert)
+
+def setup_environment(args):
+    """
+    Point the app at the fake LLM proxy and an in-process (or given) MongoDB, then seed profiles.
+    Must run before the app modules are imported, since they read settings at import time.
+    """
+    server, url = start_fake_llm_server(latency=args.llm_latency, token_latency=args.token_latency,
+                                        embedding_latency=args.embedding_latency)
+    os.environ['OPENAI_BASE_URL'] = url
+    os.environ.setdefault('api_key', 'benchmark')
+    os.environ.setdefault('uri', 'mongodb://localhost')
+    os.environ.setdefault('EMBEDDING_CACHE_STORE', 'none')
+
+    import Clients
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        Clients.use_db_client(MongoClient(args.mongo_uri))
+    else:
+        import mongomock
+        mongomock.Collection.bulk_write = _bulk_write_one_by_one
+        Clients.use_db_client(mongomock.MongoClient())
+    db = Clients.get_db()
+    from Indexes import create_indexes
+    create_indexes(db)
+    for profile in CHARACTER_PROFILES:
+        db['Profile'].update_one({"Name": profile['Name']}, {"$set": profile}, upsert=True)
+    return server, db, Clients.get_chat_client()
+
+def run_serial_turn(db, chat_client, user_name: str, character_name: str, query: str,
+                    history: List[Dict], timer: StageTimer) -> None:
+    """
+    One chat turn with every stage run in sequence, timing each stage separately.
+    """
+    from Profile import get_profile
+    from Emotion import get_emotion
+    from Memory_Test import get_relevant_memories, save_conversation_to_mongodb
+    from Prompt_Builder import build_prompt
+    from Response import complete_response
+
+    with timer.stage("turn"):
+        history.append({"role": "user", "content": query})
+        with timer.stage("get_traits"):
+            profile = get_profile(db, character_name)
+        traits, basic_info = {"Traits": profile['Traits']}, {"Summary": profile['Summary']}
+        with timer.stage("get_emotion"):
+            emotion = get_emotion(character_name, basic_info, traits, query)
+        with timer.stage("get_relevant_memories"):
+            memories = get_relevant_memories(db, user_name, character_name, query)
+        with timer.stage("generate_response"):
+            messages, _ = build_prompt(character_name, basic_info, traits, query, emotion, user_name,
+                                       history, 10, relevant_memories=memories)
+            response = complete_response(chat_client, messages)
+        history.append({"role": "assistant", "content": f"{response}\n\n*[Emotion: {emotion}]*"})
+        with timer.stage("save_conversation_to_mongodb"):
+            save_conversation_to_mongodb(db, user_name, character_name, history, chat_client)
+
+def run_pipeline_turn(db, chat_client, user_name: str, character_name: str, query: str,
+                      history: List[Dict], timer: StageTimer) -> None:
+    """
+    One chat turn as the app runs it: concurrent context stages, then the reply,
+    with persistence handed to the write-behind queue.
+    """
+    from Pipeline import gather_turn_context
+    from Prompt_Builder import build_prompt
+    from Response import complete_response
+    from Persistence import get_write_queue
+
+    with timer.stage("turn"):
+        history.append({"role": "user", "content": query})
+        with timer.stage("gather_turn_context"):
+            context = gather_turn_context(db, character_name, user_name, query)
+        with timer.stage("generate_response"):
+            messages, _ = build_prompt(character_name, context['basic_info'], context['traits'], query,
+                                       context['emotion'], user_name, history, 10,
+                                       relevant_memories=context['relevant_memories'])
+            response = complete_response(chat_client, messages)
+        history.append({"role": "assistant", "content": f"{response}\n\n*[Emotion: {context['emotion']}]*"})
+        with timer.stage("save_conversation_to_mongodb"):
+            get_write_queue(db, chat_client).submit(user_name, character_name, history[-2])
+
+def run_benchmark(args) -> Dict:
+    server, db, chat_client = setup_environment(args)
+    run_turn = run_pipeline_turn if args.mode == "pipeline" else run_serial_turn
+    timer = StageTimer()
+    rng = random.Random(args.seed)
+
+    def conversation(user_index: int):
+        user_name = f"bench_user_{user_index}"
+        character_name = CHARACTER_PROFILES[user_index % len(CHARACTER_PROFILES)]["Name"]
+        history = []
+        for _ in range(args.turns):
+            try:
+                run_turn(db, chat_client, user_name, character_name, rng.choice(USER_MESSAGES), history, timer)
+            except Exception as e:
+                print(f"Turn failed: {str(e)}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(conversation, range(args.users)))
+    if args.mode == "pipeline":
+        from Persistence import get_write_queue
+        write_queue = get_write_queue(db, chat_client)
+        write_queue.close()
+        # Messages the queue gave up on count as failed persistence, not as fast persistence
+        if write_queue.dropped:
+            timer.errors["persistence_dropped"] = write_queue.dropped
+        if write_queue.backlog():
+            timer.errors["persistence_unflushed"] = write_queue.backlog()
+    wall_time = time.perf_counter() - start
+    server.shutdown()
+
+    turns = len(timer.samples.get("turn", []))
+    return {
+        "mode": args.mode,
+        "users": args.users,
+        "turns_per_user": args.turns,
+        "concurrency": args.concurrency,
+        "wall_time_s": wall_time,
+        "throughput_turns_per_s": turns / wall_time if wall_time else 0.0,
+        "errors": timer.errors,
+        "stages": {name: summarize(samples) for name, samples in timer.samples.items()}
+    }
+
+def print_report(report: Dict) -> None:
+    print(f"\nMode: {report['mode']}  users: {report['users']}  turns/user: {report['turns_per_user']}  "
+          f"concurrency: {report['concurrency']}")
+    print(f"Wall time: {report['wall_time_s']:.2f}s  throughput: {report['throughput_turns_per_s']:.2f} turns/s")
+    print(f"{'stage':<30}{'count':>7}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    order = STAGES + sorted(set(report['stages']) - set(STAGES))
+    for name in order:
+        if name not in report['stages']:
+            continue
+        stats = report['stages'][name]
+        print(f"{name:<30}{stats['count']:>7}{stats['mean_ms']:>10.1f}{stats['p50_ms']:>10.1f}"
+              f"{stats['p90_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+    if report['errors']:
+        print(f"Errors: {report['errors']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of the chat turn pipeline")
+    parser.add_argument("--mode", choices=["serial", "pipeline"], default="serial")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=5, help="turns per user")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.002, help="seconds per output token")
+    parser.add_argument("--embedding-latency", type=float, default=0.02)
+    parser.add_argument("--mongo-uri", help="benchmark against this MongoDB instead of mongomock")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,66 @@
+import os
+from datetime import datetime
+from typing import List
+
+# Maximum number of messages per bucket document
+BUCKET_SIZE = int(os.environ.get('MEMORY_BUCKET_SIZE', 100))
+
+def bucket_update(user_name: str, character_name: str, messages: List, bucket_size: int = BUCKET_SIZE):
+    """
+    Filter and update that append messages to the open (not yet full) bucket of a
+    user-character pair, starting a new bucket once it is full.
+    """
+    now = datetime.now()
+    filter_query = {
+        "user_name": user_name,
+        "character_name": character_name,
+        "count": {"$lt": bucket_size}
+    }
+    update_data = {
+        "$push": {"messages": {"$each": messages}},
+        "$inc": {"count": len(messages)},
+        "$set": {"last_updated": now},
+        "$setOnInsert": {
+            "user_name": user_name,
+            "character_name": character_name,
+            "created": now
+        }
+    }
+    return filter_query, update_data
+
+def push_to_bucket(collection, user_name: str, character_name: str, message, bucket_size: int = BUCKET_SIZE) -> None:
+    """
+    Append one message to the pair's current bucket. Legacy unbucketed documents have
+    no count field, so they are never matched and simply stop growing.
+    """
+    filter_query, update_data = bucket_update(user_name, character_name, [message], bucket_size)
+    collection.update_one(
+        filter_query,
+        update_data,
+        upsert=True
+    )
+
+def get_latest_messages(collection, user_name: str, character_name: str, n: int) -> List:
+    """
+    Return the latest n messages of a user-character pair, oldest first, reading
+    only as many buckets as needed and only their tail messages.
+    """
+    if n <= 0:
+        return []
+
+    filter_query = {
+        "user_name": user_name,
+        "character_name": character_name
+    }
+    cursor = collection.find(
+        filter_query,
+        {"messages": {"$slice": -n}, "_id": 0}
+    ).sort("_id", -1).batch_size(2)
+
+    messages = []
+    for bucket in cursor:
+        messages = bucket.get('messages', []) + messages
+        if len(messages) >= n:
+            break
+    cursor.close()
+    return messages[-n:]
@@ -0,0 +1,110 @@
+import importlib
+import os
+import threading
+import openai
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# The HTTP library the installed openai is built on (httpx, or httpx2 in newer releases)
+httpx = importlib.import_module(openai.DefaultHttpxClient.__mro__[1].__module__.split('.')[0])
+
+base_url = os.environ.get('OPENAI_BASE_URL', "https://api.ai.it.cornell.edu")
+db_name = "Character_1"
+
+# Connection pools
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 50))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 5))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 300000))
+OPENAI_MAX_CONNECTIONS = int(os.environ.get('OPENAI_MAX_CONNECTIONS', 100))
+OPENAI_MAX_KEEPALIVE = int(os.environ.get('OPENAI_MAX_KEEPALIVE', 20))
+OPENAI_TIMEOUT = float(os.environ.get('OPENAI_TIMEOUT', 60))
+
+# Process-wide client registry, shared by every module and every Streamlit session
+_lock = threading.RLock()
+_db_client = None
+_chat_client = None
+_warmed_up = False
+
+def get_db_client() -> MongoClient:
+    """
+    Return the shared MongoClient, creating it on first use.
+    """
+    global _db_client
+    if _db_client is None:
+        with _lock:
+            if _db_client is None:
+                _db_client = MongoClient(
+                    os.environ['uri'],
+                    server_api=ServerApi('1'),
+                    maxPoolSize=MONGO_MAX_POOL_SIZE,
+                    minPoolSize=MONGO_MIN_POOL_SIZE,
+                    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS
+                )
+    return _db_client
+
+def use_db_client(client) -> None:
+    """
+    Replace the shared MongoClient, e.g. with an in-process stand-in for benchmarks.
+    """
+    global _db_client
+    with _lock:
+        _db_client = client
+
+def get_db():
+    """
+    Return the Character_1 database on the shared client.
+    """
+    return get_db_client()[db_name]
+
+def get_chat_client() -> openai.OpenAI:
+    """
+    Return the shared OpenAI client, creating it on first use.
+    """
+    global _chat_client
+    if _chat_client is None:
+        with _lock:
+            if _chat_client is None:
+                _chat_client = openai.OpenAI(
+                    api_key=os.environ['api_key'],
+                    base_url=base_url,
+                    timeout=OPENAI_TIMEOUT,
+                    http_client=openai.DefaultHttpxClient(
+                        limits=httpx.Limits(
+                            max_connections=OPENAI_MAX_CONNECTIONS,
+                            max_keepalive_connections=OPENAI_MAX_KEEPALIVE
+                        )
+                    )
+                )
+    return _chat_client
+
+def warm_up(check_llm: bool = False) -> None:
+    """
+    Open connections ahead of the first chat turn. Runs once per process.
+    Raises if MongoDB cannot be reached.
+    """
+    global _warmed_up
+    if _warmed_up:
+        return
+
+    with _lock:
+        if _warmed_up:
+            return
+        # Ping MongoDB so the connection pool and TLS session are established
+        try:
+            get_db_client().admin.command('ping')
+        except Exception as e:
+            print(f"Error connecting to MongoDB: {e}")
+            raise
+
+        # Optionally open a keep-alive connection to the LLM proxy
+        if check_llm:
+            try:
+                get_chat_client().models.list()
+            except Exception as e:
+                print(f"Error warming up chat client: {e}")
+
+        _warmed_up = True
@@ -1,18 +1,10 @@
-import openai
-import os
-from dotenv import load_dotenv
-
-api_key= os.environ['api_key']
-
-base_url= "https://api.ai.it.cornell.edu"
-
-client = openai.OpenAI(
-    api_key=api_key,
-    base_url=base_url
-)
+from Clients import get_chat_client
+from Metrics import traced, record_usage
 
+@traced("emotion")
 def get_emotion(character_name,info_summary,personality_traits,query):
     
+    client = get_chat_client()
     response = client.chat.completions.create(
 
     model="openai.gpt-4o", # model to send to the proxy
@@ -41,5 +33,6 @@ def get_emotion(character_name,info_summary,personality_traits,query):
         ]
 
     )
+    record_usage("emotion", response)
     return response.choices[0].message.content
     
\ No newline at end of file
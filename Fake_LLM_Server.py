@@ -0,0 +1,197 @@
+import argparse
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+# Canned output of the stand-in model
+REPLY = "*smiles warmly and leans back* Oh, that's lovely to hear! Tell me a bit more about your day, I'd really like to know."
+EMOTION = "I feel warm and curious about the conversation."
+EMBEDDING_DIMENSIONS = 1536
+
+def fake_embedding(text: str, dimensions: int = EMBEDDING_DIMENSIONS) -> list:
+    """
+    Deterministic unit vector derived from the text, so identical texts embed identically.
+    """
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dimensions)
+    return (vector / np.linalg.norm(vector)).round(6).tolist()
+
+def fake_completion(messages: list, json_mode: bool) -> str:
+    prompt = messages[-1]["content"] if messages else ""
+    if json_mode:
+        # Batch importance classifier: answer every numbered message
+        numbers = re.findall(r'^\s*(\d+)\. "', prompt, re.M)
+        if numbers:
+            return json.dumps({number: "yes" if int(number) % 3 == 0 else "no" for number in numbers})
+        return json.dumps({"emotion": EMOTION, "reply": REPLY})
+    if "Answer with just 'yes' or 'no'" in prompt:
+        return "no"
+    if "Please provide only your emotions" in prompt:
+        return EMOTION
+    if "running summary of a conversation" in prompt:
+        return "They chatted about their day and plans."
+    return REPLY
+
+def count_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    """
+    Minimal OpenAI-compatible API: chat completions (plain, JSON and streaming),
+    embeddings and model listing, with configurable latency.
+    """
+    # Set on the subclass created by start_fake_llm_server
+    latency = 0.0
+    token_latency = 0.0
+    embedding_latency = 0.0
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload: dict, status: int = 200) -> None:
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            self._send_json({"object": "list", "data": [
+                {"id": "openai.gpt-4o", "object": "model", "created": 0, "owned_by": "fake"}
+            ]})
+        else:
+            self._send_json({"error": {"message": "not found"}}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        if self.path.rstrip('/').endswith('/chat/completions'):
+            self._chat(request)
+        elif self.path.rstrip('/').endswith('/embeddings'):
+            self._embeddings(request)
+        else:
+            self._send_json({"error": {"message": "not found"}}, 404)
+
+    def _chat(self, request: dict) -> None:
+        messages = request.get("messages", [])
+        json_mode = (request.get("response_format") or {}).get("type") == "json_object"
+        content = fake_completion(messages, json_mode)
+        prompt_tokens = sum(count_tokens(str(msg.get("content", ""))) for msg in messages)
+        completion_tokens = count_tokens(content)
+        created = int(time.time())
+        model = request.get("model", "openai.gpt-4o")
+        time.sleep(self.latency)
+
+        if not request.get("stream"):
+            time.sleep(self.token_latency * completion_tokens)
+            self._send_json({
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop"
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens
+                }
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for token in re.findall(r"\S+\s*", content):
+            time.sleep(self.token_latency)
+            self._send_chunk({
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]
+            })
+        self._send_chunk({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+        })
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _send_chunk(self, payload: dict) -> None:
+        self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode('utf-8'))
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def _embeddings(self, request: dict) -> None:
+        inputs = request.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        time.sleep(self.embedding_latency)
+        tokens = sum(count_tokens(text) for text in inputs)
+        self._send_json({
+            "object": "list",
+            "data": [
+                {"object": "embedding", "index": i, "embedding": fake_embedding(text)}
+                for i, text in enumerate(inputs)
+            ],
+            "model": request.get("model", "openai.text-embedding-3-small"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+        })
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients close streams early on purpose; only report unexpected errors
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+def start_fake_llm_server(host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                          token_latency: float = 0.0, embedding_latency: float = 0.0):
+    """
+    Start the stand-in server on a background thread. Returns (server, base_url).
+    """
+    handler = type("ConfiguredFakeLLMHandler", (FakeLLMHandler,), {
+        "latency": latency,
+        "token_latency": token_latency,
+        "embedding_latency": embedding_latency
+    })
+    server = FakeLLMServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stand-in for the LLM proxy")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="seconds per output token")
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    server, url = start_fake_llm_server(port=args.port, latency=args.latency,
+                                        token_latency=args.token_latency,
+                                        embedding_latency=args.embedding_latency)
+    print(f"Fake LLM proxy listening on {url} (set OPENAI_BASE_URL to this)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,160 @@
+import argparse
+import os
+import sys
+import threading
+from typing import Dict, List
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from Memory_Test import memory_pipeline, RELEVANT_MEMORY_LIMIT
+from Vector_Codec import EMBEDDING_FIELDS
+from Buckets import BUCKET_SIZE
+from Session_Store import SESSION_COLLECTION, SESSION_TTL
+
+# Create missing indexes when the app starts
+AUTO_CREATE_INDEXES = os.environ.get('AUTO_CREATE_INDEXES', '1') == '1'
+
+PAIR = [("user_name", ASCENDING), ("character_name", ASCENDING)]
+
+# Indexes backing every hot query: (collection, keys, options)
+INDEXES = [
+    # get_profile / update_profile
+    ("Profile", [("Name", ASCENDING)], {"name": "name"}),
+    # Open-bucket upsert of push_to_bucket and the write-behind queue
+    ("Short_term_memo", PAIR + [("count", ASCENDING)], {"name": "pair_open_bucket"}),
+    # get_latest_messages: newest buckets of a pair first
+    ("Short_term_memo", PAIR + [("_id", DESCENDING)], {"name": "pair_newest"}),
+    ("Long_term_memo", PAIR + [("count", ASCENDING)], {"name": "pair_open_bucket"}),
+    ("Long_term_memo", PAIR + [("_id", DESCENDING)], {"name": "pair_newest"}),
+    # Candidate scan of the numpy vector search
+    ("Long_term_vectors", PAIR, {"name": "pair"}),
+    # load_summary / save_summary: one running summary per pair
+    ("Conversation_summary", PAIR, {"name": "pair", "unique": True}),
+    # Chat service sessions (looked up by _id) are removed once idle for SESSION_TTL
+    (SESSION_COLLECTION, [("last_used", ASCENDING)], {"name": "expiry", "expireAfterSeconds": int(SESSION_TTL)}),
+]
+
+def hot_queries(user_name: str = "index_check_user", character_name: str = "Emily Turner") -> List[Dict]:
+    """
+    The app's hot read paths, each with a callable returning its explain output.
+    """
+    pair = {"user_name": user_name, "character_name": character_name}
+    return [
+        {"name": "get_profile", "collection": "Profile",
+         "explain": lambda db: db['Profile'].find({"Name": character_name}, {"Traits": 1, "Summary": 1, "_id": 0}).explain()},
+        {"name": "short_term open bucket", "collection": "Short_term_memo",
+         "explain": lambda db: db['Short_term_memo'].find({**pair, "count": {"$lt": BUCKET_SIZE}}).explain()},
+        {"name": "get_recent_conversation", "collection": "Short_term_memo",
+         "explain": lambda db: db['Short_term_memo'].find(pair, {"messages": {"$slice": -10}, "_id": 0}).sort("_id", -1).explain()},
+        {"name": "long_term open bucket", "collection": "Long_term_memo",
+         "explain": lambda db: db['Long_term_memo'].find({**pair, "count": {"$lt": BUCKET_SIZE}}).explain()},
+        {"name": "get_recent_memories", "collection": "Long_term_memo",
+         "explain": lambda db: db['Long_term_memo'].find(pair, {"messages": {"$slice": -5}, "_id": 0}).sort("_id", -1).explain()},
+        {"name": "get_relevant_memories", "collection": "Long_term_memo",
+         "explain": lambda db: db.command("explain", {
+             "aggregate": "Long_term_memo",
+             "pipeline": memory_pipeline(user_name, character_name, RELEVANT_MEMORY_LIMIT),
+             "cursor": {}
+         })},
+        {"name": "vector candidates", "collection": "Long_term_vectors",
+         "explain": lambda db: db['Long_term_vectors'].find(pair, {field: 1 for field in EMBEDDING_FIELDS}).explain()},
+        {"name": "load_summary", "collection": "Conversation_summary",
+         "explain": lambda db: db['Conversation_summary'].find(pair, {"summary": 1, "_id": 0}).explain()},
+    ]
+
+def create_indexes(db) -> List[str]:
+    """
+    Create every index in INDEXES. Existing identical indexes are left as they are,
+    so this is safe to run on every start or deploy. Returns the names it ensured.
+    """
+    ensured = []
+    for collection, keys, options in INDEXES:
+        try:
+            ensured.append(f"{collection}.{db[collection].create_index(keys, **options)}")
+        except OperationFailure as e:
+            # E.g. an index with the same keys but other options, or duplicates blocking a unique index
+            print(f"Error creating index {options.get('name')} on {collection}: {str(e)}")
+    return ensured
+
+_ensured = False
+_ensure_lock = threading.Lock()
+
+def ensure_indexes(db) -> None:
+    """
+    Create the indexes once per process at startup, unless AUTO_CREATE_INDEXES is off.
+    """
+    global _ensured
+    if not AUTO_CREATE_INDEXES:
+        return
+    with _ensure_lock:
+        if not _ensured:
+            create_indexes(db)
+            _ensured = True
+
+def plan_stages(plan) -> List[str]:
+    """
+    All stage names in an explain plan, whichever engine produced it.
+    """
+    stages = []
+    if isinstance(plan, dict):
+        if isinstance(plan.get('stage'), str):
+            stages.append(plan['stage'])
+        for value in plan.values():
+            stages += plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            stages += plan_stages(item)
+    return stages
+
+def winning_plans(explain) -> List[Dict]:
+    """
+    Every winning plan in an explain output; aggregations nest theirs inside pipeline stages.
+    """
+    plans = []
+    if isinstance(explain, dict):
+        for key, value in explain.items():
+            if key == 'winningPlan':
+                plans.append(value)
+            else:
+                plans += winning_plans(value)
+    elif isinstance(explain, list):
+        for item in explain:
+            plans += winning_plans(item)
+    return plans
+
+def check_query_plans(db) -> List[Dict]:
+    """
+    Explain each hot query and report the stages of its winning plan.
+    """
+    results = []
+    for query in hot_queries():
+        stages = plan_stages(winning_plans(query['explain'](db)))
+        results.append({
+            "name": query['name'],
+            "collection": query['collection'],
+            "stages": stages,
+            "collection_scan": "COLLSCAN" in stages
+        })
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the app's MongoDB indexes and verify hot query plans")
+    parser.add_argument("--check", action="store_true",
+                        help="explain the hot queries and exit non-zero on any collection scan")
+    parser.add_argument("--no-create", action="store_true", help="only check, do not create indexes")
+    args = parser.parse_args()
+
+    from Clients import get_db
+    db = get_db()
+    if not args.no_create:
+        for name in create_indexes(db):
+            print(f"Ensured index {name}")
+
+    if args.check:
+        failures = 0
+        for result in check_query_plans(db):
+            status = "COLLSCAN" if result['collection_scan'] else "ok"
+            print(f"[{status}] {result['name']} ({result['collection']}): {' -> '.join(result['stages'])}")
+            failures += result['collection_scan']
+        if failures:
+            print(f"{failures} hot queries scan a whole collection")
+            sys.exit(1)
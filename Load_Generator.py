@@ -0,0 +1,337 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import bson
+import numpy as np
+from Benchmark import CHARACTER_PROFILES, USER_MESSAGES, setup_environment, summarize
+
+# Scripted conversations; sampled mode draws turns from Benchmark.USER_MESSAGES instead
+SCRIPTS = [
+    [
+        "hi",
+        "How was your day?",
+        "I just started a new job as a nurse at the children's hospital.",
+        "The night shifts are hard but I love the kids.",
+        "Do you have any advice for staying motivated?",
+        "Thanks, that helps. Talk soon!"
+    ],
+    [
+        "hello",
+        "What are you up to this weekend?",
+        "My sister is getting married next month and I'm nervous about my speech.",
+        "She's my only sibling, we grew up in Denver together.",
+        "lol ok",
+        "Any tips for speaking in front of a crowd?"
+    ],
+    [
+        "hey",
+        "I love hiking too, I went up Mount Rainier last summer.",
+        "My dog Max always comes with me.",
+        "What's your favourite trail?",
+        "I'm allergic to bees so I carry an epipen.",
+        "Tell me about your work."
+    ]
+]
+
+GROWTH_COLLECTIONS = ["Short_term_memo", "Long_term_memo", "Long_term_vectors", "Conversation_summary"]
+
+class LoadStats:
+    """
+    Per-turn latencies, errors and completion times of a load run.
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.first_token = []
+        self.completed_at = []
+        self.errors = {}
+        self.sessions = 0
+
+    def record_turn(self, started: float, latency: float, first_token: Optional[float] = None) -> None:
+        self.latencies.append(latency)
+        self.completed_at.append(started + latency)
+        if first_token is not None:
+            self.first_token.append(first_token)
+
+    def record_error(self, e: Exception) -> None:
+        kind = type(e).__name__
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+class InProcessTarget:
+    """
+    Drives a ChatService in this process (against the fake LLM proxy and mongomock, or a real MongoDB).
+    """
+
+    def __init__(self, db, chat_client):
+        from Service import ChatService
+        self.service = ChatService(db, chat_client)
+
+    async def create_session(self, user_name: str, character_name: str) -> str:
+        session = await asyncio.to_thread(self.service.create_session, user_name, character_name)
+        return session.session_id
+
+    async def send(self, session_id: str, message: str, stream: bool) -> Optional[float]:
+        session = await asyncio.to_thread(self.service.get_session, session_id)
+        if not stream:
+            await self.service.reply(session, message)
+            return None
+        start, first_token = time.perf_counter(), None
+        async for event in self.service.reply_stream(session, message):
+            if first_token is None and event["type"] == "token":
+                first_token = time.perf_counter() - start
+        return first_token
+
+class HttpTarget:
+    """
+    Drives a deployed chat service (Api.py) over HTTP.
+    """
+
+    def __init__(self, base_url: str):
+        from Api_Client import ChatApiClient
+        self.api = ChatApiClient(base_url)
+
+    async def create_session(self, user_name: str, character_name: str) -> str:
+        session = await asyncio.to_thread(self.api.create_session, user_name, character_name)
+        return session['session_id']
+
+    async def send(self, session_id: str, message: str, stream: bool) -> Optional[float]:
+        if not stream:
+            await asyncio.to_thread(self.api.send, session_id, message)
+            return None
+
+        def consume():
+            start, first_token = time.perf_counter(), None
+            for event in self.api.stream(session_id, message):
+                if first_token is None and event["type"] == "token":
+                    first_token = time.perf_counter() - start
+            return first_token
+        return await asyncio.to_thread(consume)
+
+async def simulated_user(target, user_index: int, args, stats: LoadStats, rng: random.Random) -> None:
+    # Users arrive evenly over the ramp-up period
+    await asyncio.sleep(args.ramp_up * user_index / max(args.users, 1))
+    user_name = f"load_user_{user_index}"
+    character_name = CHARACTER_PROFILES[user_index % len(CHARACTER_PROFILES)]["Name"]
+    if args.sampled:
+        conversation = [rng.choice(USER_MESSAGES) for _ in range(args.turns)]
+    else:
+        script = SCRIPTS[user_index % len(SCRIPTS)]
+        conversation = [script[i % len(script)] for i in range(args.turns)]
+
+    try:
+        session_id = await target.create_session(user_name, character_name)
+        stats.sessions += 1
+    except Exception as e:
+        stats.record_error(e)
+        return
+
+    for message in conversation:
+        started = time.perf_counter()
+        try:
+            first_token = await target.send(session_id, message, args.stream)
+            stats.record_turn(started, time.perf_counter() - started, first_token)
+        except Exception as e:
+            stats.record_error(e)
+        # Think time between messages
+        await asyncio.sleep(rng.uniform(0, 2 * args.think_time))
+
+def collection_growth(db, name: str) -> Dict:
+    """
+    Document count and data size of a collection. Falls back to summing BSON sizes
+    where collStats is unavailable (e.g. mongomock).
+    """
+    collection = db[name]
+    try:
+        stats = db.command("collStats", name)
+        return {"documents": stats.get("count", 0), "bytes": stats.get("size", 0)}
+    except Exception:
+        size = sum(len(bson.encode(doc)) for doc in collection.find())
+        return {"documents": collection.count_documents({}), "bytes": size}
+
+def bucket_contention(db) -> Dict:
+    """
+    How concentrated short-term writes are: buckets per pair and the fullest bucket.
+    Every turn of a pair is a $push onto that pair's newest bucket document.
+    """
+    collection = db['Short_term_memo']
+    fullest = collection.find_one({}, {"count": 1, "user_name": 1, "character_name": 1}, sort=[("count", -1)])
+    pairs = len({(doc['user_name'], doc['character_name'])
+                 for doc in collection.find({}, {"user_name": 1, "character_name": 1})})
+    return {
+        "pairs": pairs,
+        "buckets": collection.count_documents({}),
+        "max_messages_per_bucket": (fullest or {}).get("count", 0)
+    }
+
+async def sample_growth(db, interval: float, start: float, samples: List[Dict], stop: asyncio.Event,
+                        write_queue=None) -> None:
+    while True:
+        sample = {"elapsed_s": round(time.perf_counter() - start, 2)}
+        try:
+            for name in GROWTH_COLLECTIONS:
+                sample[name] = await asyncio.to_thread(collection_growth, db, name)
+            sample["contention"] = await asyncio.to_thread(bucket_contention, db)
+            # Only known for the in-process target
+            sample["write_backlog"] = write_queue.backlog() if write_queue is not None else "-"
+        except Exception as e:
+            sample["error"] = str(e)
+        samples.append(sample)
+        if stop.is_set():
+            return
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+def timeline(stats: LoadStats, start: float, interval: float) -> List[Dict]:
+    """
+    Completed turns, throughput and latency per interval of the run.
+    """
+    if not stats.completed_at:
+        return []
+    done = np.asarray(stats.completed_at) - start
+    latencies = np.asarray(stats.latencies) * 1000
+    rows = []
+    for i in range(int(done.max() // interval) + 1):
+        mask = (done >= i * interval) & (done < (i + 1) * interval)
+        if not mask.any():
+            continue
+        rows.append({
+            "elapsed_s": round((i + 1) * interval, 2),
+            "turns": int(mask.sum()),
+            "turns_per_s": round(mask.sum() / interval, 2),
+            "p50_ms": round(float(np.percentile(latencies[mask], 50)), 1),
+            "p99_ms": round(float(np.percentile(latencies[mask], 99)), 1)
+        })
+    return rows
+
+async def run_load(args) -> Dict:
+    db, write_queue = None, None
+    if args.target == "local":
+        server, db, chat_client = setup_environment(args)
+        target = InProcessTarget(db, chat_client)
+        from Persistence import get_write_queue
+        write_queue = get_write_queue(db, chat_client)
+    else:
+        server = None
+        target = HttpTarget(args.target)
+        if args.mongo_uri:
+            from pymongo import MongoClient
+            db = MongoClient(args.mongo_uri)[args.db_name]
+
+    # Blocking calls run on threads; size the pool so users do not queue for one
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=args.users + 8))
+    stats = LoadStats()
+    rng = random.Random(args.seed)
+    samples, stop = [], asyncio.Event()
+    start = time.perf_counter()
+    sampler = None
+    if db is not None:
+        sampler = asyncio.create_task(sample_growth(db, args.sample_interval, start, samples, stop, write_queue))
+
+    await asyncio.gather(*(simulated_user(target, i, args, stats, random.Random(rng.random()))
+                           for i in range(args.users)))
+    wall_time = time.perf_counter() - start
+
+    turns = len(stats.latencies)
+    attempts = turns + sum(stats.errors.values())
+    if write_queue is not None:
+        # Let the write-behind queue drain so the final sample shows the settled size
+        deadline = time.monotonic() + args.drain_timeout
+        while write_queue.backlog() and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        # Messages that were never persisted are failed turns, not free ones
+        if write_queue.dropped:
+            stats.errors["persistence_dropped"] = write_queue.dropped
+        if write_queue.backlog():
+            stats.errors["persistence_unflushed"] = write_queue.backlog()
+    if sampler is not None:
+        stop.set()
+        await sampler
+    if server is not None:
+        server.shutdown()
+
+    from Metrics import registry
+    return {
+        "target": args.target,
+        "users": args.users,
+        "sessions": stats.sessions,
+        "turns_per_user": args.turns,
+        "stream": args.stream,
+        "wall_time_s": wall_time,
+        "turns": turns,
+        "throughput_turns_per_s": turns / wall_time if wall_time else 0.0,
+        "error_rate": min(sum(stats.errors.values()) / attempts, 1.0) if attempts else 0.0,
+        "errors": stats.errors,
+        "latency": summarize(stats.latencies) if stats.latencies else {},
+        "first_token": summarize(stats.first_token) if stats.first_token else {},
+        "timeline": timeline(stats, start, args.sample_interval),
+        "growth": samples,
+        "stage_metrics": registry.render() if args.target == "local" else None
+    }
+
+def print_report(report: Dict) -> None:
+    print(f"\nTarget: {report['target']}  users: {report['users']}  sessions: {report['sessions']}  "
+          f"turns/user: {report['turns_per_user']}  stream: {report['stream']}")
+    print(f"Wall time: {report['wall_time_s']:.2f}s  turns: {report['turns']}  "
+          f"throughput: {report['throughput_turns_per_s']:.2f} turns/s  error rate: {report['error_rate']:.2%}")
+    if report['errors']:
+        print(f"Errors: {report['errors']}")
+    for name in ("latency", "first_token"):
+        stats = report[name]
+        if stats:
+            print(f"{name:<12} mean {stats['mean_ms']:.1f}ms  p50 {stats['p50_ms']:.1f}ms  "
+                  f"p90 {stats['p90_ms']:.1f}ms  p99 {stats['p99_ms']:.1f}ms  max {stats['max_ms']:.1f}ms")
+
+    print("\nThroughput over time")
+    print(f"{'elapsed_s':>10}{'turns':>8}{'turns/s':>10}{'p50_ms':>10}{'p99_ms':>10}")
+    for row in report['timeline']:
+        print(f"{row['elapsed_s']:>10}{row['turns']:>8}{row['turns_per_s']:>10}{row['p50_ms']:>10}{row['p99_ms']:>10}")
+
+    if report['growth']:
+        print("\nMongo growth (documents / KB) and short-term bucket contention")
+        print(f"{'elapsed_s':>10}" + "".join(f"{name:>24}" for name in GROWTH_COLLECTIONS)
+              + f"{'pairs':>8}{'buckets':>9}{'max/bucket':>12}{'backlog':>9}")
+        for sample in report['growth']:
+            if "error" in sample:
+                print(f"{sample['elapsed_s']:>10}  {sample['error']}")
+                continue
+            cells = "".join(
+                f"{sample[name]['documents']:>14} / {sample[name]['bytes'] / 1024:>7.1f}" for name in GROWTH_COLLECTIONS
+            )
+            contention = sample['contention']
+            print(f"{sample['elapsed_s']:>10}{cells}{contention['pairs']:>8}{contention['buckets']:>9}"
+                  f"{contention['max_messages_per_bucket']:>12}{sample['write_backlog']:>9}")
+    else:
+        print("\nMongo growth and bucket contention: not sampled (needs --mongo-uri for an HTTP target)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate many concurrent users chatting with the characters")
+    parser.add_argument("--target", default="local",
+                        help="'local' for an in-process service on the fake LLM proxy, or the base URL of a deployed Api.py")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--turns", type=int, default=6, help="messages per user")
+    parser.add_argument("--ramp-up", type=float, default=10, help="seconds over which users arrive")
+    parser.add_argument("--think-time", type=float, default=1.0, help="mean seconds between a user's messages")
+    parser.add_argument("--sampled", action="store_true", help="sample messages instead of following scripts")
+    parser.add_argument("--stream", action="store_true", help="stream replies and measure time to first token")
+    parser.add_argument("--sample-interval", type=float, default=5.0, help="seconds between growth samples")
+    parser.add_argument("--drain-timeout", type=float, default=30.0)
+    parser.add_argument("--mongo-uri", help="MongoDB to use (local target) or to sample growth from (HTTP target)")
+    parser.add_argument("--db-name", default="Character_1")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="fake proxy: seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="fake proxy: seconds per output token")
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_load(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
@@ -1,15 +1,12 @@
 import os
-import openai
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from datetime import datetime
-
-#Initialize embedding model
-api_key= os.environ['api_key']
-base_url= "https://api.ai.it.cornell.edu"
-embedding_client = openai.OpenAI(
-    api_key=api_key,
-    base_url=base_url
-)
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List
+from pymongo import UpdateOne
+from Clients import get_chat_client, get_db
+from Buckets import push_to_bucket
+from Metrics import span, record_usage
 
 def save_conversation_to_mongodb(db, user_name, character_name, messages):
     Short_term = db['Short_term_memo']
@@ -18,33 +15,130 @@ def save_conversation_to_mongodb(db, user_name, character_name, messages):
     latest_message = messages[-1] if messages else None
     
     if latest_message:
-        # 使用 user_name 和 character_name 作为唯一标识
-        filter_query = {
-            "user_name": user_name,
-            "character_name": character_name
-        }
-        
-        # 更新数据，使用 $push 追加新消息，同时更新时间戳
-        update_data = {
-            "$push": {"messages": latest_message},
-            "$set": {"last_updated": datetime.now()},
-            "$setOnInsert": {
-                "user_name": user_name,
-                "character_name": character_name
-            }
-        }
-        
-        # 更新或插入对话记录
-        Short_term.update_one(
-            filter_query,
-            update_data,
-            upsert=True
-        )
+        # 按 user_name 和 character_name 分桶追加新消息，桶满后自动新建
+        push_to_bucket(Short_term, user_name, character_name, latest_message)
+
+# Embeddings
+EMBEDDING_MODEL = "openai.text-embedding-3-small"
+EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', 256))
+EMBEDDING_BATCH_TOKENS = int(os.environ.get('EMBEDDING_BATCH_TOKENS', 250000))
+EMBEDDING_CACHE_SIZE = int(os.environ.get('EMBEDDING_CACHE_SIZE', 10000))
+# Set to 'none' to keep the embedding cache in memory only
+EMBEDDING_CACHE_STORE = os.environ.get('EMBEDDING_CACHE_STORE', 'mongo')
+
+def content_hash(text: str) -> str:
+    """
+    Cache key for an embedding: the model name plus the exact text.
+    """
+    return hashlib.sha256(f"{EMBEDDING_MODEL}\n{text}".encode('utf-8')).hexdigest()
+
+def estimate_tokens(text: str) -> int:
+    # Rough count (about 4 characters per token) used to keep batches under the request limit
+    return len(text) // 4 + 1
+
+class EmbeddingCache:
+    """
+    Content-hash keyed embedding cache: an in-memory LRU backed by the Embedding_cache collection.
+    """
+
+    def __init__(self, max_size: int = EMBEDDING_CACHE_SIZE, store: str = EMBEDDING_CACHE_STORE):
+        self.max_size = max_size
+        self.store = store
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _collection(self):
+        return get_db()['Embedding_cache'] if self.store == 'mongo' else None
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+
+        missing = [key for key in keys if key not in found]
+        if missing:
+            try:
+                collection = self._collection()
+                if collection is not None:
+                    for doc in collection.find({"_id": {"$in": missing}}, {"embedding": 1}):
+                        found[doc['_id']] = doc['embedding']
+                        self._remember(doc['_id'], doc['embedding'])
+            except Exception as e:
+                print(f"Error reading embedding cache: {str(e)}")
+        return found
+
+    def put_many(self, embeddings: Dict[str, List[float]]) -> None:
+        for key, embedding in embeddings.items():
+            self._remember(key, embedding)
+        try:
+            collection = self._collection()
+            if collection is not None and embeddings:
+                collection.bulk_write([
+                    UpdateOne({"_id": key}, {"$setOnInsert": {"embedding": embedding, "model": EMBEDDING_MODEL}}, upsert=True)
+                    for key, embedding in embeddings.items()
+                ], ordered=False)
+        except Exception as e:
+            print(f"Error writing embedding cache: {str(e)}")
+
+    def _remember(self, key: str, embedding: List[float]) -> None:
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+embedding_cache = EmbeddingCache()
+
+def _batches(texts: List[str]):
+    # Pack inputs into requests bounded by both input count and estimated tokens
+    batch, tokens = [], 0
+    for text in texts:
+        size = estimate_tokens(text)
+        if batch and (len(batch) >= EMBEDDING_BATCH_SIZE or tokens + size > EMBEDDING_BATCH_TOKENS):
+            yield batch
+            batch, tokens = [], 0
+        batch.append(text)
+        tokens += size
+    if batch:
+        yield batch
+
+def get_embeddings(texts: List[str]) -> List[List[float]]:
+    """
+    Generate embeddings for many texts, in input order. Cached texts are never
+    re-embedded and the rest are sent in as few requests as the limits allow.
+    """
+    keys = [content_hash(text) for text in texts]
+    found = embedding_cache.get_many(list(dict.fromkeys(keys)))
+
+    # Embed each distinct uncached text once
+    pending = {}
+    for key, text in zip(keys, texts):
+        if key not in found:
+            pending.setdefault(key, text)
+
+    if pending:
+        embedding_client = get_chat_client()
+        pending_keys = list(pending)
+        computed = {}
+        start = 0
+        for batch in _batches([pending[key] for key in pending_keys]):
+            with span("embedding", inputs=len(batch)) as record:
+                response = embedding_client.embeddings.create(
+                    model=EMBEDDING_MODEL,
+                    input=batch
+                )
+                record_usage("embedding", response, record)
+            for item in sorted(response.data, key=lambda item: item.index):
+                computed[pending_keys[start + item.index]] = item.embedding
+            start += len(batch)
+        embedding_cache.put_many(computed)
+        found.update(computed)
+
+    return [found[key] for key in keys]
 
 #Generates vector embeddings for the given data.
 def get_embedding(data):
-    response = embedding_client.embeddings.create(
-        model="openai.text-embedding-3-small",
-        input=data
-    )    
-    return response.data[0].embedding
+    return get_embeddings([data])[0]
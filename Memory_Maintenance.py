@@ -0,0 +1,197 @@
+import math
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from Vector_Memory import VECTOR_COLLECTION, backfill_memory_vectors, pair_vectors
+from Vector_Codec import EMBEDDING_FIELDS
+from Vector_Snapshot import bump_version
+
+MEMORY_CAPACITY = int(os.environ.get('MEMORY_CAPACITY', 200))                          # memories kept per user-character pair
+MEMORY_DUPLICATE_THRESHOLD = float(os.environ.get('MEMORY_DUPLICATE_THRESHOLD', 0.9))  # cosine similarity of near-duplicates
+MEMORY_HALF_LIFE_DAYS = float(os.environ.get('MEMORY_HALF_LIFE_DAYS', 30))             # a memory's value halves this often
+# Seconds between in-process compactions; 0 (the default) leaves it to one scheduled
+# `python Memory_Maintenance.py` job, since passes in several processes would race on the same pairs
+MEMORY_COMPACTION_INTERVAL = float(os.environ.get('MEMORY_COMPACTION_INTERVAL', 0))
+
+def memory_score(memory: Dict, now: datetime) -> float:
+    """
+    Value of a memory: boosted by how often it was mentioned and halved every
+    MEMORY_HALF_LIFE_DAYS since it was last mentioned. Every stored memory passed the
+    same yes/no importance check, so importance itself does not rank them.
+    """
+    last_seen = memory.get('last_seen') or memory.get('timestamp')
+    age_days = (now - last_seen).total_seconds() / 86400 if isinstance(last_seen, datetime) else 0.0
+    mentions = max(memory.get('mentions', 1), 1)
+    return (1 + math.log(mentions)) * 0.5 ** (max(age_days, 0.0) / MEMORY_HALF_LIFE_DAYS)
+
+def _load_pair(db, user_name: str, character_name: str) -> Tuple[List[Dict], np.ndarray]:
+    # Vectors come from the pair's snapshot or cache; only the small metadata is read from MongoDB
+    ids, vectors = pair_vectors(db, user_name, character_name)
+    rows = {memory_id: row for row, memory_id in enumerate(ids)}
+    memories = [
+        memory for memory in db[VECTOR_COLLECTION].find(
+            {"user_name": user_name, "character_name": character_name},
+            {"content": 1, "timestamp": 1, "last_seen": 1, "mentions": 1}
+        )
+        # Written after the vectors were read; the next pass picks it up
+        if memory['_id'] in rows
+    ]
+    # Oldest first, so duplicates merge into the memory that was stored first
+    memories.sort(key=lambda memory: (not isinstance(memory.get('timestamp'), datetime),
+                                      memory.get('timestamp') or datetime.min, str(memory['_id'])))
+    return memories, np.asarray(vectors, dtype=np.float32)[[rows[memory['_id']] for memory in memories]]
+
+def find_duplicates(memories: List[Dict], matrix: np.ndarray, candidates: Optional[set] = None,
+                    threshold: float = MEMORY_DUPLICATE_THRESHOLD) -> Dict[int, int]:
+    """
+    Map the index of each near-duplicate memory to the index of the earlier memory it
+    repeats, given one vector row per memory. Only memories whose ids are in candidates
+    (all, if None) can be duplicates.
+    """
+    if len(memories) < 2:
+        return {}
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix = matrix / np.where(norms == 0, 1, norms)
+
+    duplicates = {}
+    kept = []
+    for i, memory in enumerate(memories):
+        if kept and (candidates is None or memory['_id'] in candidates):
+            scores = matrix[kept] @ matrix[i]
+            best = int(np.argmax(scores))
+            if scores[best] >= threshold:
+                duplicates[i] = kept[best]
+                continue
+        kept.append(i)
+    return duplicates
+
+def _remove(db, user_name: str, character_name: str, memories: List[Dict]) -> None:
+    # Drop memories from the vectors and from their long-term buckets
+    if not memories:
+        return
+    pair = {"user_name": user_name, "character_name": character_name}
+    ids = [memory['_id'] for memory in memories]
+    contents = [memory['content'] for memory in memories]
+    db[VECTOR_COLLECTION].delete_many({"_id": {"$in": ids}})
+    Long_term = db['Long_term_memo']
+    Long_term.update_many({**pair, "messages._id": {"$in": ids}}, {"$pull": {"messages": {"_id": {"$in": ids}}}})
+    # Legacy memories are plain strings or single-content documents without ids
+    Long_term.update_many({**pair, "messages": {"$in": contents}}, {"$pull": {"messages": {"$in": contents}}})
+    Long_term.delete_many({**pair, "content": {"$in": contents}})
+
+def _merge(db, user_name: str, character_name: str, keep: Dict, duplicates: List[Dict], now: datetime) -> None:
+    # Fold duplicates into the kept memory (updated in place too, so it is scored as merged):
+    # add up mentions and keep the most detailed wording
+    group = [keep] + duplicates
+    richest = max(group, key=lambda memory: len(memory['content']))
+    update = {
+        "mentions": sum(max(memory.get('mentions', 1), 1) for memory in group),
+        "last_seen": now,
+        "content": richest['content']
+    }
+    if richest is not keep:
+        # The kept memory takes over the richer wording's vector too
+        stored = db[VECTOR_COLLECTION].find_one({"_id": richest['_id']}, {field: 1 for field in EMBEDDING_FIELDS}) or {}
+        update.update({field: stored[field] for field in EMBEDDING_FIELDS if field in stored})
+    db[VECTOR_COLLECTION].update_one({"_id": keep['_id']}, {"$set": update})
+    original_content = keep['content']
+    keep.update(update)
+    if richest['content'] != original_content:
+        db['Long_term_memo'].update_one(
+            {"user_name": user_name, "character_name": character_name, "messages._id": keep['_id']},
+            {"$set": {"messages.$.content": richest['content']}}
+        )
+    _remove(db, user_name, character_name, duplicates)
+
+def maintain_pair(db, user_name: str, character_name: str, new_ids: Optional[List] = None,
+                  capacity: int = MEMORY_CAPACITY, threshold: float = MEMORY_DUPLICATE_THRESHOLD) -> Dict[str, int]:
+    """
+    Merge near-duplicate memories of a pair and evict the lowest-value ones beyond capacity.
+    With new_ids, only those memories are checked for duplicates (the incremental case).
+    """
+    now = datetime.now()
+    memories, matrix = _load_pair(db, user_name, character_name)
+    duplicates = find_duplicates(memories, matrix, set(new_ids) if new_ids is not None else None, threshold)
+
+    groups = {}
+    for duplicate, original in duplicates.items():
+        groups.setdefault(original, []).append(memories[duplicate])
+    for original, group in groups.items():
+        _merge(db, user_name, character_name, memories[original], group, now)
+
+    remaining = [memory for i, memory in enumerate(memories) if i not in duplicates]
+    evicted = []
+    if len(remaining) > capacity:
+        remaining.sort(key=lambda memory: memory_score(memory, now))
+        evicted = remaining[:len(remaining) - capacity]
+        _remove(db, user_name, character_name, evicted)
+
+    if duplicates or evicted:
+        # Local vector snapshots of the pair are stale now
+        bump_version(db, user_name, character_name)
+    return {"merged": len(duplicates), "evicted": len(evicted)}
+
+def maintain_after_write(db, memories: List[Dict]) -> None:
+    """
+    Incremental maintenance for newly stored memories (with user_name, character_name and _id).
+    Failures are logged; the scheduled compaction (this module run as a job) catches up.
+    """
+    pairs = {}
+    for memory in memories:
+        pairs.setdefault((memory['user_name'], memory['character_name']), []).append(memory['_id'])
+    for (user_name, character_name), new_ids in pairs.items():
+        try:
+            stats = maintain_pair(db, user_name, character_name, new_ids)
+            if stats['merged'] or stats['evicted']:
+                print(f"Memory maintenance for {user_name}/{character_name}: {stats}")
+        except Exception as e:
+            print(f"Error maintaining memories: {str(e)}")
+
+def compact_memories(db, backfill: bool = True) -> Dict[str, int]:
+    """
+    Full pass over every pair: embed memories missing vectors, merge all near-duplicates
+    and enforce the capacity.
+    """
+    if backfill:
+        backfill_memory_vectors(db)
+    totals = {"pairs": 0, "merged": 0, "evicted": 0}
+    pairs = db[VECTOR_COLLECTION].aggregate([
+        {"$group": {"_id": {"user_name": "$user_name", "character_name": "$character_name"}}}
+    ])
+    for pair in pairs:
+        stats = maintain_pair(db, pair['_id']['user_name'], pair['_id']['character_name'])
+        totals["pairs"] += 1
+        totals["merged"] += stats["merged"]
+        totals["evicted"] += stats["evicted"]
+    return totals
+
+_compaction_thread = None
+_compaction_lock = threading.Lock()
+
+def start_memory_compaction(db, interval: float = MEMORY_COMPACTION_INTERVAL) -> None:
+    """
+    Run compact_memories every `interval` seconds on a background thread, once per process.
+    Disabled when the interval is 0, the default; only enable it in a single process.
+    """
+    global _compaction_thread
+    if interval <= 0:
+        return
+
+    def run():
+        while True:
+            threading.Event().wait(interval)
+            try:
+                print(f"Memory compaction: {compact_memories(db)}")
+            except Exception as e:
+                print(f"Error compacting memories: {str(e)}")
+
+    with _compaction_lock:
+        if _compaction_thread is None:
+            _compaction_thread = threading.Thread(target=run, name="memory-compaction", daemon=True)
+            _compaction_thread.start()
+
+if __name__ == "__main__":
+    from Clients import get_db
+    print(f"Memory compaction: {compact_memories(get_db())}")
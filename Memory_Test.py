@@ -1,14 +1,37 @@
+import os
+import re
+import json
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from typing import Dict
+from typing import Dict, List, Optional
+from bson import ObjectId
+from Vector_Memory import add_memory_vector, search_memories
+from Buckets import push_to_bucket, get_latest_messages
+from Metrics import span, record_usage, traced
+from Memory_Maintenance import maintain_after_write
 
-def extract_personal_info(message: str, chat_client) -> bool:
-    """
-    Use a simple prompt-based approach to determine if a message contains important personal information.
-    """
-    
-    relevance_check = f"""
-    Is the following message sharing any personal information or significant details about the speaker? 
-    Consider things like:
+# First-stage lexicon for the importance classifier
+SMALL_TALK = {
+    "ok", "okay", "k", "kk", "lol", "lmao", "haha", "hahaha", "hehe", "hi", "hello", "hey", "yo",
+    "thanks", "thank you", "thx", "ty", "yes", "yeah", "yep", "no", "nope", "nah", "cool", "nice",
+    "great", "sure", "hmm", "hm", "wow", "oh", "ah", "bye", "goodbye", "good night", "good morning",
+    "how are you", "what's up", "whats up", "sup", "same", "me too", "really", "right", "true"
+}
+# Only unambiguous personal facts are a local yes; preferences, feelings and plans
+# ("I like that", "I feel like you are joking") are left to the LLM
+PERSONAL_PATTERNS = [re.compile(pattern) for pattern in [
+    r"\bmy name is\b",
+    r"\bi(?:'m| am) \d+(?: years old\b|$)",
+    r"\bi (?:work|study|live|moved|grew up|graduated|teach) (?:as|at|in|from|to|for)\b",
+    r"\bi(?:'m| am) (?:from|getting married|pregnant|allergic)\b",
+    r"\bmy (?:mom|mum|dad|mother|father|sister|brother|wife|husband|partner|boyfriend|girlfriend|son|daughter|"
+    r"kids?|family|boss|job|birthday|dog|cat|doctor|therapist) (?:is|was|has|had|just|got|passed|died)\b",
+    r"\b(?:diagnosed|surgery|medication)\b"
+]]
+FIRST_PERSON = re.compile(r"\b(?:i|i'm|im|i've|i'd|i'll|me|my|mine|myself|we|our|us)\b")
+
+RELEVANCE_CRITERIA = """Consider things like:
     - Personal details (name, age, location, etc.)
     - Recent plans or events
     - Life experiences or events
@@ -19,7 +42,75 @@ def extract_personal_info(message: str, chat_client) -> bool:
     - Feelings or emotions
     - Health information
     - Any other meaningful personal sharing
-    Make sure to include relevant information only.
+    Make sure to include relevant information only."""
+
+# Number of memories added to the prompt
+RELEVANT_MEMORY_LIMIT = int(os.environ.get('RELEVANT_MEMORY_LIMIT', 5))
+
+# Maximum number of messages classified per batch request
+CLASSIFIER_BATCH_SIZE = int(os.environ.get('CLASSIFIER_BATCH_SIZE', 40))
+
+# Cache of classifier decisions keyed by normalized message text
+CLASSIFIER_CACHE_SIZE = int(os.environ.get('CLASSIFIER_CACHE_SIZE', 5000))
+_classifier_cache = OrderedDict()
+_classifier_cache_lock = threading.Lock()
+
+def normalize_message(message: str) -> str:
+    """
+    Lowercase, collapse whitespace and trim surrounding punctuation and emoji.
+    """
+    text = " ".join(message.lower().split())
+    return re.sub(r"^[^\w']+|[^\w'?]+$", "", text)
+
+def prefilter_personal_info(message: str) -> Optional[bool]:
+    """
+    Cheap local first stage for the importance classifier. Returns True or False for
+    obvious cases and None when the message should be escalated to the LLM.
+    """
+    text = normalize_message(message)
+    if not text or text.rstrip('?!. ') in SMALL_TALK:
+        return False
+
+    if any(pattern.search(text) for pattern in PERSONAL_PATTERNS):
+        return True
+
+    # Without any first-person reference, short messages and questions rarely share personal details
+    if not FIRST_PERSON.search(text) and (len(text.split()) <= 6 or text.endswith('?')):
+        return False
+
+    return None
+
+def _cached_classification(key: str) -> Optional[bool]:
+    with _classifier_cache_lock:
+        if key in _classifier_cache:
+            _classifier_cache.move_to_end(key)
+            return _classifier_cache[key]
+    return None
+
+def _cache_classification(key: str, is_important: bool) -> None:
+    with _classifier_cache_lock:
+        _classifier_cache[key] = is_important
+        _classifier_cache.move_to_end(key)
+        while len(_classifier_cache) > CLASSIFIER_CACHE_SIZE:
+            _classifier_cache.popitem(last=False)
+
+def extract_personal_info(message: str, chat_client) -> bool:
+    """
+    Determine if a message contains important personal information. Obvious cases are
+    decided locally; only ambiguous messages are sent to the LLM, and its answers are cached.
+    """
+    decision = prefilter_personal_info(message)
+    if decision is not None:
+        return decision
+
+    key = normalize_message(message)
+    decision = _cached_classification(key)
+    if decision is not None:
+        return decision
+    
+    relevance_check = f"""
+    Is the following message sharing any personal information or significant details about the speaker? 
+    {RELEVANCE_CRITERIA}
 
     Message: "{message}"
 
@@ -27,21 +118,118 @@ def extract_personal_info(message: str, chat_client) -> bool:
     """
     
     try:
-        response = chat_client.chat.completions.create(
-            model="openai.gpt-4o",
-            messages=[{"role": "user", "content": relevance_check}],
-            temperature=0,
-            max_tokens=5
-        )
+        with span("classifier", messages=1) as record:
+            response = chat_client.chat.completions.create(
+                model="openai.gpt-4o",
+                messages=[{"role": "user", "content": relevance_check}],
+                temperature=0,
+                max_tokens=5
+            )
+            record_usage("classifier", response, record)
         
         answer = response.choices[0].message.content.strip().lower()
-        return answer == 'yes'
+        is_important = answer.startswith('yes')
+        _cache_classification(key, is_important)
+        return is_important
         
     except Exception as e:
         print(f"Error in relevance check: {str(e)}")
         # If there's an error, we'll be conservative and store the message
         return True
 
+def parse_batch_answers(content: str, count: int) -> Dict[int, bool]:
+    """
+    Parse yes/no answers for numbered messages (1-based) from a batch classifier output.
+    Accepts {"answers": [...]}, {"1": "yes", ...} or "1: yes" lines; unparseable items are left out.
+    """
+    answers = {}
+    try:
+        data = json.loads(content)
+        if isinstance(data, dict) and isinstance(data.get('answers'), list):
+            data = {str(i + 1): answer for i, answer in enumerate(data['answers'])}
+        if isinstance(data, dict):
+            for number, answer in data.items():
+                if str(number).isdigit() and str(answer).strip().lower() in ('yes', 'no', 'true', 'false'):
+                    answers[int(number)] = str(answer).strip().lower() in ('yes', 'true')
+    except ValueError:
+        for number, answer in re.findall(r"(\d+)\s*[:.)\-\]\"']*\s*(yes|no)\b", content.lower()):
+            answers[int(number)] = answer == 'yes'
+    return {number: answer for number, answer in answers.items() if 1 <= number <= count}
+
+def _classify_batch_llm(messages: List[str], chat_client) -> Dict[int, bool]:
+    numbered = "\n".join(f'{i + 1}. "{message}"' for i, message in enumerate(messages))
+    relevance_check = f"""
+    For each numbered message below, decide whether it is sharing any personal information or significant details about the speaker.
+    {RELEVANCE_CRITERIA}
+
+    Messages:
+    {numbered}
+
+    Respond with a JSON object mapping each message number to 'yes' or 'no', for example {{"1": "yes", "2": "no"}}.
+    """
+    with span("classifier", messages=len(messages)) as record:
+        response = chat_client.chat.completions.create(
+            model="openai.gpt-4o",
+            messages=[{"role": "user", "content": relevance_check}],
+            temperature=0,
+            max_tokens=10 * len(messages) + 20,
+            response_format={"type": "json_object"}
+        )
+        record_usage("classifier", response, record)
+    return parse_batch_answers(response.choices[0].message.content, len(messages))
+
+def classify_messages_batch(messages: List[str], chat_client) -> List[bool]:
+    """
+    Classify many messages for important personal information, in input order. Obvious
+    and cached cases are decided locally; the rest share one LLM call per batch, and any
+    item the batch call fails to answer falls back to the single-message classifier.
+    """
+    decisions = [prefilter_personal_info(message) for message in messages]
+
+    # Distinct ambiguous messages, keyed by normalized text
+    pending = OrderedDict()
+    for i, message in enumerate(messages):
+        if decisions[i] is None:
+            key = normalize_message(message)
+            cached = _cached_classification(key)
+            if cached is not None:
+                decisions[i] = cached
+            else:
+                pending.setdefault(key, message)
+
+    results = {}
+    keys = list(pending)
+    for start in range(0, len(keys), CLASSIFIER_BATCH_SIZE):
+        chunk = keys[start:start + CLASSIFIER_BATCH_SIZE]
+        try:
+            answers = _classify_batch_llm([pending[key] for key in chunk], chat_client)
+        except Exception as e:
+            print(f"Error in batch relevance check: {str(e)}")
+            answers = {}
+        for i, key in enumerate(chunk):
+            if i + 1 in answers:
+                results[key] = answers[i + 1]
+                _cache_classification(key, answers[i + 1])
+            else:
+                results[key] = extract_personal_info(pending[key], chat_client)
+
+    return [
+        decision if decision is not None else results[normalize_message(message)]
+        for decision, message in zip(decisions, messages)
+    ]
+
+def make_memory(content: str) -> Dict:
+    """
+    Build a long-term memory entry. Each memory gets its own id and timestamp so its
+    vector can be stored alongside it.
+    """
+    return {
+        "_id": ObjectId(),
+        "role": "user",
+        "content": content,
+        "timestamp": datetime.now()
+    }
+
 def save_to_long_term_memory(db, user_name: str, character_name: str, message: Dict, chat_client):
     """
     Store important information in long-term memory.
@@ -50,7 +238,7 @@ def save_to_long_term_memory(db, user_name: str, character_name: str, message: D
         Long_term = db['Long_term_memo']
     
         # Check if the message contains important information
-        is_important = extract_personal_info(message['content'], chat_client)
+        is_important = classify_messages_batch([message['content']], chat_client)[0]
         print(f"Is message important? {is_important}")
         
         if not is_important:
@@ -59,72 +247,90 @@ def save_to_long_term_memory(db, user_name: str, character_name: str, message: D
         
         print("✓ Message contains important information")
         
-        filter_query = {
-            "user_name": user_name,
-            "character_name": character_name
-        }
-            
-        update_data = {
-            "$push": {"messages": message['content']},
-            "$set": {"last_updated": datetime.now()},
-            "$setOnInsert": {
-                "user_name": user_name,
-                "character_name": character_name
-            }
-        }
+        memory = make_memory(message['content'])
             
-        Long_term.update_one(
-            filter_query,
-            update_data,
-            upsert=True
-        )
+        push_to_bucket(Long_term, user_name, character_name, memory)
+        
+        # Embed once at write time; the memory itself is already saved if this fails
+        try:
+            add_memory_vector(db, user_name, character_name, memory['_id'], memory['content'], memory['timestamp'])
+        except Exception as e:
+            print(f"Error embedding memory: {str(e)}")
+            return
+        
+        # Merge it into an earlier near-duplicate and enforce the pair's capacity
+        maintain_after_write(db, [{**memory, "user_name": user_name, "character_name": character_name}])
         
     except Exception as e:
         raise
 
-def get_relevant_memories(db, user_name: str, character_name: str) -> str:
+def memory_pipeline(user_name: str, character_name: str, limit: int) -> List[Dict]:
+    """
+    Aggregation returning the newest `limit` usable memories of a pair as {"content"} documents.
+    Handles bucketed documents (messages of dicts), legacy documents (messages of strings)
+    and single-memory documents (a content field). Dict messages count only from the user;
+    plain strings are dropped if they are bracketed actions or emotion annotations.
+    """
+    return [
+        {"$match": {"user_name": user_name, "character_name": character_name}},
+        {"$project": {
+            "_id": 0,
+            # $unwind treats a single content string as a one-element array
+            "entries": {"$ifNull": ["$messages", "$content"]},
+            "doc_timestamp": {"$ifNull": ["$timestamp", "$created"]}
+        }},
+        {"$unwind": "$entries"},
+        {"$project": {
+            # Plain strings have no content field (message dicts without one are dropped below)
+            "is_text": {"$eq": [{"$ifNull": ["$entries.content", None]}, None]},
+            "entries": 1,
+            "doc_timestamp": 1
+        }},
+        {"$project": {
+            "content": {"$cond": ["$is_text", "$entries", "$entries.content"]},
+            "role": {"$cond": ["$is_text", "text", "$entries.role"]},
+            # Per-message timestamp where the message has one, else its document's
+            "timestamp": {"$cond": ["$is_text", "$doc_timestamp", {"$ifNull": ["$entries.timestamp", "$doc_timestamp"]}]}
+        }},
+        {"$match": {
+            "content": {"$type": "string"},
+            "$or": [
+                {"role": "user"},
+                {"role": "text", "$nor": [{"content": {"$regex": r"^\["}}, {"content": {"$regex": r"\*\[Emotion:"}}]}
+            ]
+        }},
+        {"$sort": {"timestamp": -1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "content": 1}}
+    ]
+
+@traced("memories")
+def get_relevant_memories(db, user_name: str, character_name: str, query: Optional[str] = None) -> str:
     """
-    Retrieve all memories for a user-character pair.
+    Retrieve memories for a user-character pair. With a query, the memories most similar
+    to it are returned; otherwise (or if vector search fails) all memories are scanned.
     """
+    if query:
+        try:
+            similar = search_memories(db, user_name, character_name, query, k=RELEVANT_MEMORY_LIMIT)
+            if similar:
+                result = "\n".join(f"User mentioned: {content.strip()}" for content in similar)
+                print(f"Number of relevant memories found: {len(similar)}")
+                return result
+        except Exception as e:
+            print(f"Error in vector memory search: {str(e)}")
+
     try:
-        Long_term = db['Long_term_memo']
-        
-        # Get all memories for this user and character
-        filter_query = {
-            "user_name": user_name,
-            "character_name": character_name
-        }
-        
-        memories = list(Long_term.find(filter_query).sort("timestamp", -1))
-        
-        # Format memories as a string
-        memory_text = []
-        for memory in memories:
-            if isinstance(memory.get('messages'), list):
-                for msg in memory['messages']:
-                    # Only process user messages or messages without a role (direct content)
-                    if isinstance(msg, dict):
-                        if msg.get('role') == 'user':
-                            content = msg['content'].strip()
-                            memory_text.append(f"User mentioned: {content}")
-                    elif isinstance(msg, str) and not msg.startswith('[') and '*[Emotion:' not in msg:
-                        # This catches direct string messages that aren't emotion tags or action brackets
-                        content = msg.strip()
-                        memory_text.append(f"User mentioned: {content}")
-            
-            elif isinstance(memory.get('content'), str):
-                content = memory['content'].strip()
-                if not content.startswith('[') and '*[Emotion:' not in content:
-                    memory_text.append(f"User mentioned: {content}")
+        # Filtering, ordering and the limit all run server-side; only the kept memories are returned
+        memories = db['Long_term_memo'].aggregate(memory_pipeline(user_name, character_name, RELEVANT_MEMORY_LIMIT))
+        memory_text = [f"User mentioned: {memory['content'].strip()}" for memory in memories]
         
         if not memory_text:
             return "No previous information available."
         
-        # Take up to 5 most recent memories (if available)
-        relevant_memories = memory_text[:5] if len(memory_text) > 5 else memory_text
-        print(f"Number of relevant memories found: {len(relevant_memories)}")
+        print(f"Number of relevant memories found: {len(memory_text)}")
         
-        result = "\n".join(relevant_memories)
+        result = "\n".join(memory_text)
         print(f"Cleaned and formatted memories:\n{result}")
         return result
         
@@ -135,6 +341,18 @@ def get_relevant_memories(db, user_name: str, character_name: str) -> str:
         print(f"Full traceback: {traceback.format_exc()}")
         return "Error retrieving previous information."
 
+def get_recent_conversation(db, user_name: str, character_name: str, n: int = 10) -> List:
+    """
+    Retrieve the latest n short-term messages for a user-character pair, oldest first.
+    """
+    return get_latest_messages(db['Short_term_memo'], user_name, character_name, n)
+
+def get_recent_memories(db, user_name: str, character_name: str, n: int = 5) -> List:
+    """
+    Retrieve the latest n long-term memories for a user-character pair, oldest first.
+    """
+    return get_latest_messages(db['Long_term_memo'], user_name, character_name, n)
+
 def save_conversation_to_mongodb(db, user_name, character_name, messages, chat_client):
     """
     Save conversation to both short-term and long-term memory.
@@ -147,25 +365,7 @@ def save_conversation_to_mongodb(db, user_name, character_name, messages, chat_c
         
         if latest_message:            
             # Store in short-term memory
-            filter_query = {
-                "user_name": user_name,
-                "character_name": character_name
-            }
-            
-            update_data = {
-                "$push": {"messages": latest_message},
-                "$set": {"last_updated": datetime.now()},
-                "$setOnInsert": {
-                    "user_name": user_name,
-                    "character_name": character_name
-                }
-            }
-            
-            Short_term.update_one(
-                filter_query,
-                update_data,
-                upsert=True
-            )
+            push_to_bucket(Short_term, user_name, character_name, latest_message)
             
             # Check and store in long-term memory if important
             save_to_long_term_memory(db, user_name, character_name, latest_message, chat_client)
@@ -0,0 +1,217 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+# Export
+METRICS_LOG = os.environ.get('METRICS_LOG', '0') == '1'   # set to 1 for one JSON line per span on stdout
+METRICS_FILE = os.environ.get('METRICS_FILE')             # Prometheus text file, rewritten after each turn
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 0))     # serve /metrics on this port when set
+
+# Histogram buckets for stage durations, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Spans started within a turn carry its id, including those run on pipeline workers
+_turn_id = contextvars.ContextVar('turn_id', default=None)
+
+def _label_key(labels: Dict[str, str]) -> Tuple:
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key: Tuple, extra: Optional[Tuple] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+class MetricsRegistry:
+    """
+    Process-wide counters and latency histograms, rendered in the Prometheus text format.
+    """
+
+    def __init__(self, buckets: Tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, labels: Dict[str, str], value: float = 1, help_text: str = "") -> None:
+        with self._lock:
+            self._help.setdefault(name, ("counter", help_text))
+            series = self._counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, labels: Dict[str, str], value: float, help_text: str = "") -> None:
+        with self._lock:
+            self._help.setdefault(name, ("histogram", help_text))
+            series = self._histograms.setdefault(name, {})
+            histogram = series.setdefault(_label_key(labels), {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def render(self) -> str:
+        """
+        Render all series in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for name, series in self._counters.items():
+                kind, help_text = self._help[name]
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            for name, series in self._histograms.items():
+                kind, help_text = self._help[name]
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                for key, histogram in series.items():
+                    for bound, count in zip(self.buckets, histogram["buckets"]):
+                        lines.append(f"{name}_bucket{_format_labels(key, ('le', bound))} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(key, ('le', '+Inf'))} {histogram['count']}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram['sum']}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+registry = MetricsRegistry()
+
+def log_event(event: Dict) -> None:
+    if METRICS_LOG:
+        print(json.dumps(event, default=str))
+
+@contextmanager
+def span(stage: str, **fields):
+    """
+    Time a pipeline stage. Records its duration and errors, and logs one JSON line.
+    Yields a dict the caller can add fields to (e.g. token usage) before the span ends.
+    """
+    record = dict(fields)
+    status = "ok"
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        status = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+        registry.inc("chat_stage_errors_total", {"stage": stage}, help_text="Failed pipeline stages")
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        registry.observe("chat_stage_duration_seconds", {"stage": stage}, duration,
+                         help_text="Pipeline stage latency in seconds")
+        log_event({
+            "event": "span",
+            "stage": stage,
+            "turn_id": _turn_id.get(),
+            "duration_ms": round(duration * 1000, 2),
+            "status": status,
+            "timestamp": time.time(),
+            **record
+        })
+
+def traced(stage: str):
+    """
+    Decorator running every call of a function inside a span.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextmanager
+def turn_span(**fields):
+    """
+    Span covering a whole chat turn. Nested spans are tagged with its turn id, and
+    the Prometheus file (if configured) is rewritten when the turn ends.
+    """
+    token = _turn_id.set(uuid.uuid4().hex[:12])
+    try:
+        with span("turn", **fields) as record:
+            yield record
+    finally:
+        _turn_id.reset(token)
+        if METRICS_FILE:
+            try:
+                write_prometheus_file(METRICS_FILE)
+            except OSError as e:
+                print(f"Error writing metrics file: {str(e)}")
+
+def record_usage(stage: str, response, record: Optional[Dict] = None) -> None:
+    """
+    Count the tokens reported in an OpenAI response (or final stream chunk) under a stage.
+    """
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        count = getattr(usage, kind, None)
+        if count is None:
+            continue
+        registry.inc("chat_llm_tokens_total", {"stage": stage, "kind": kind.split("_")[0]}, count,
+                     help_text="Tokens reported by the LLM proxy")
+        if record is not None:
+            record[kind] = record.get(kind, 0) + count
+
+def submit_in_context(executor, fn, *args, **kwargs):
+    """
+    Submit to an executor so the task runs with the caller's context (and turn id).
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+def write_prometheus_file(path: str = METRICS_FILE) -> None:
+    """
+    Atomically write the current metrics, e.g. for the node exporter textfile collector.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(registry.render())
+    os.replace(tmp_path, path)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+_server = None
+_server_lock = threading.Lock()
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = "0.0.0.0"):
+    """
+    Serve /metrics on a background thread, once per process. No-op when no port is configured.
+    """
+    global _server
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+            print(f"Serving metrics on port {port}")
+    return _server
@@ -0,0 +1,203 @@
+import atexit
+import os
+import queue
+import threading
+from collections import OrderedDict
+from typing import Dict, List
+from pymongo import UpdateOne
+from Clients import get_chat_client
+from Buckets import bucket_update
+from Memory_Test import classify_messages_batch, make_memory
+from Vector_Memory import add_memory_vectors
+from Memory_Maintenance import maintain_after_write
+from Metrics import registry, span
+
+# Write-behind queue
+WRITE_BATCH_SIZE = int(os.environ.get('WRITE_BATCH_SIZE', 100))
+WRITE_FLUSH_INTERVAL = float(os.environ.get('WRITE_FLUSH_INTERVAL', 0.5))
+WRITE_MAX_RETRIES = int(os.environ.get('WRITE_MAX_RETRIES', 5))
+WRITE_SHUTDOWN_TIMEOUT = float(os.environ.get('WRITE_SHUTDOWN_TIMEOUT', 30))
+
+def _bucket_ops(records: List[Dict], field: str) -> List[UpdateOne]:
+    # Coalesce all entries of a user-character pair into one bucket append
+    grouped = OrderedDict()
+    for record in records:
+        grouped.setdefault((record['user_name'], record['character_name']), []).append(record[field])
+    return [
+        UpdateOne(*bucket_update(user_name, character_name, entries), upsert=True)
+        for (user_name, character_name), entries in grouped.items()
+    ]
+
+def _classified_ops(records: List[Dict]) -> List[UpdateOne]:
+    # Flag each stored short-term message as classified (one not yet flagged, for repeated texts),
+    # as the offline backfill does by position
+    return [
+        UpdateOne(
+            {"user_name": record['user_name'], "character_name": record['character_name'],
+             "messages": {"$elemMatch": {
+                 "role": record['message'].get('role'),
+                 "content": record['message']['content'],
+                 "timestamp": record['message'].get('timestamp'),
+                 "classified": {"$ne": True}
+             }}},
+            {"$set": {"messages.$.classified": True}}
+        )
+        for record in records
+    ]
+
+class WriteBehindQueue:
+    """
+    Background persistence for chat turns. Records are written to Short_term_memo,
+    classified for importance and written to Long_term_memo (plus their vectors) in
+    bulk batches on a worker thread. Each stage is tracked per record, so a failed
+    batch is retried from the stage that failed (at-least-once delivery).
+    """
+
+    def __init__(self, db, chat_client=None, batch_size: int = WRITE_BATCH_SIZE,
+                 flush_interval: float = WRITE_FLUSH_INTERVAL, max_retries: int = WRITE_MAX_RETRIES):
+        self.db = db
+        self.chat_client = chat_client or get_chat_client()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        # Records given up on after max_retries, i.e. messages that were never (fully) persisted
+        self.dropped = 0
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._worker.start()
+
+    def submit(self, user_name: str, character_name: str, message: Dict, long_term: bool = True) -> None:
+        """
+        Queue a message for persistence and return immediately.
+        """
+        self._queue.put({
+            "user_name": user_name,
+            "character_name": character_name,
+            "message": message,
+            "short_saved": False,
+            "important": None if long_term else False,
+            "memory": None,
+            "long_saved": False,
+            "vector_saved": False,
+            # Messages kept out of long-term memory stay unflagged for the offline backfill
+            "flag_saved": not long_term,
+            "attempts": 0
+        })
+
+    def backlog(self) -> int:
+        """
+        Number of records waiting to be written.
+        """
+        return self._queue.qsize()
+
+    def _run(self) -> None:
+        while not (self._stop.is_set() and self._queue.empty()):
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch: List[Dict]) -> None:
+        try:
+            with span("persistence", messages=len(batch)):
+                self._write(batch)
+        except Exception as e:
+            print(f"Error flushing write-behind batch: {str(e)}")
+            self._retry(batch)
+
+    def _write(self, batch: List[Dict]) -> None:
+        # Stages already done for a record (on an earlier attempt) are skipped
+        pending = [record for record in batch if not record['short_saved']]
+        if pending:
+            self.db['Short_term_memo'].bulk_write(_bucket_ops(pending, 'message'), ordered=False)
+            for record in pending:
+                record['short_saved'] = True
+
+        # Importance classification runs here, off the request path, in one batch call
+        pending = [record for record in batch if record['important'] is None]
+        if pending:
+            decisions = classify_messages_batch(
+                [record['message']['content'] for record in pending],
+                self.chat_client
+            )
+            for record, is_important in zip(pending, decisions):
+                record['important'] = is_important
+                if is_important:
+                    record['memory'] = make_memory(record['message']['content'])
+
+        pending = [record for record in batch if record['important'] and not record['long_saved']]
+        if pending:
+            self.db['Long_term_memo'].bulk_write(_bucket_ops(pending, 'memory'), ordered=False)
+            for record in pending:
+                record['long_saved'] = True
+
+        # Only now is the message's classification durable; the offline backfill skips flagged messages
+        pending = [
+            record for record in batch
+            if not record['flag_saved'] and (record['important'] is False or record['long_saved'])
+        ]
+        if pending:
+            self.db['Short_term_memo'].bulk_write(_classified_ops(pending), ordered=False)
+            for record in pending:
+                record['flag_saved'] = True
+
+        pending = [record for record in batch if record['long_saved'] and not record['vector_saved']]
+        if pending:
+            memories = [
+                {**record['memory'], "user_name": record['user_name'], "character_name": record['character_name']}
+                for record in pending
+            ]
+            add_memory_vectors(self.db, memories)
+            for record in pending:
+                record['vector_saved'] = True
+
+            # Deduplicate and enforce capacity; not retried, the scheduled compaction catches up
+            maintain_after_write(self.db, memories)
+
+    def _retry(self, batch: List[Dict]) -> None:
+        attempts = 0
+        for record in batch:
+            done = record['short_saved'] and record['flag_saved'] and (not record['important'] or record['vector_saved'])
+            if done:
+                continue
+            record['attempts'] += 1
+            if record['attempts'] > self.max_retries:
+                print(f"Dropping message after {self.max_retries} retries: {record['message']}")
+                self.dropped += 1
+                registry.inc("chat_persistence_dropped_total", {}, help_text="Messages dropped by the write-behind queue")
+                continue
+            self._queue.put(record)
+            attempts = max(attempts, record['attempts'])
+
+        # Back off before the retried records are picked up again
+        if attempts:
+            self._stop.wait(min(self.flush_interval * 2 ** attempts, 30))
+
+    def close(self, timeout: float = WRITE_SHUTDOWN_TIMEOUT) -> None:
+        """
+        Stop the worker once everything still queued has been flushed.
+        """
+        self._stop.set()
+        self._worker.join(timeout)
+
+_write_queue = None
+_write_queue_lock = threading.Lock()
+
+def get_write_queue(db, chat_client=None) -> WriteBehindQueue:
+    """
+    Return the process-wide write-behind queue, starting it on first use. It is
+    flushed when the process exits.
+    """
+    global _write_queue
+    with _write_queue_lock:
+        if _write_queue is None:
+            _write_queue = WriteBehindQueue(db, chat_client)
+            atexit.register(_write_queue.close)
+    return _write_queue
@@ -0,0 +1,121 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Dict, Optional
+from Profile import get_profile
+from Emotion import get_emotion
+from Memory_Test import get_relevant_memories
+from Vector_Memory import VECTOR_BACKEND, pair_vectors
+from Summary import load_summary
+from Response import DEFAULT_EMOTION
+from Metrics import submit_in_context
+
+# Per-stage timeouts in seconds, measured from the start of the turn
+STAGE_TIMEOUTS = {
+    "profile": float(os.environ.get('PROFILE_TIMEOUT', 5)),
+    "emotion": float(os.environ.get('EMOTION_TIMEOUT', 30)),
+    "memories": float(os.environ.get('MEMORIES_TIMEOUT', 10))
+}
+
+# Longest the first turn waits for context prefetched when the character was selected
+PREFETCH_TIMEOUT = float(os.environ.get('PREFETCH_TIMEOUT', 10))
+
+DEFAULT_MEMORIES = "No previous information available."
+
+# Shared worker pool for all sessions in this process. A turn holds up to 3 workers, and a
+# stage that timed out keeps its worker until its call returns (bounded by OPENAI_TIMEOUT for
+# emotion), so size it at about 3x the concurrent turns expected in one process.
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('PIPELINE_WORKERS', 32)),
+    thread_name_prefix="turn"
+)
+
+def _wait(future, deadline: float, stage: str, default):
+    try:
+        return future.result(timeout=max(0.0, deadline - time.monotonic()))
+    except TimeoutError:
+        # Frees the worker if the stage has not started yet; a running call cannot be interrupted
+        future.cancel()
+        print(f"Stage '{stage}' timed out, using fallback")
+        return default
+    except Exception as e:
+        print(f"Stage '{stage}' failed: {str(e)}")
+        return default
+
+def gather_turn_context(db, character_name: str, user_name: str, query: str,
+                        with_memories: bool = True, with_emotion: bool = True,
+                        timeouts: Optional[Dict] = None) -> Dict:
+    """
+    Run profile fetch, emotion inference and memory retrieval concurrently and join the results.
+    Pass with_emotion=False when the reply call also produces the emotion.
+    Raises LookupError if the profile is missing or cannot be fetched in time.
+    """
+    timeouts = {**STAGE_TIMEOUTS, **(timeouts or {})}
+    start = time.monotonic()
+
+    profile_future = submit_in_context(_executor, get_profile, db, character_name)
+
+    def infer_emotion():
+        # Waits for the profile stage instead of fetching the profile a second time. It was
+        # submitted first, so it is already running; a failure there fails the turn anyway
+        try:
+            profile = profile_future.result(timeout=timeouts["profile"])
+        except Exception:
+            return DEFAULT_EMOTION
+        if profile is None:
+            return DEFAULT_EMOTION
+        return get_emotion(
+            character_name,
+            {"Summary": profile['Summary']},
+            {"Traits": profile['Traits']},
+            query
+        )
+
+    emotion_future = None
+    if with_emotion:
+        emotion_future = submit_in_context(_executor, infer_emotion)
+    memories_future = None
+    if with_memories:
+        memories_future = submit_in_context(_executor, get_relevant_memories, db, user_name, character_name, query)
+
+    # The response cannot be generated without the profile, so its failure is not masked
+    try:
+        profile = profile_future.result(timeout=timeouts["profile"])
+    except TimeoutError:
+        profile = None
+        error = f"Profile of character {character_name} not fetched within {timeouts['profile']}s"
+    else:
+        error = f"No profile found for character {character_name}"
+    if profile is None:
+        for future in (profile_future, emotion_future, memories_future):
+            if future is not None:
+                future.cancel()
+        raise LookupError(error)
+
+    emotion = None
+    if emotion_future is not None:
+        emotion = _wait(emotion_future, start + timeouts["emotion"], "emotion", DEFAULT_EMOTION)
+    relevant_memories = None
+    if memories_future is not None:
+        relevant_memories = _wait(memories_future, start + timeouts["memories"], "memories", DEFAULT_MEMORIES)
+
+    return {
+        "traits": {"Traits": profile['Traits']},
+        "basic_info": {"Summary": profile['Summary']},
+        "emotion": emotion,
+        "relevant_memories": relevant_memories
+    }
+
+def prefetch_context(db, user_name: str, character_name: str, with_memories: bool = True) -> Dict:
+    """
+    Start loading a conversation's turn-independent context as soon as the character is
+    selected: the profile and the pair's memory vectors into the shared caches, and the
+    running summary. Returns the futures by name; the summary future resolves to the summary.
+    """
+    futures = {
+        "profile": submit_in_context(_executor, get_profile, db, character_name),
+        "summary": submit_in_context(_executor, load_summary, db, user_name, character_name)
+    }
+    if with_memories and VECTOR_BACKEND == 'numpy':
+        futures["memories"] = submit_in_context(_executor, pair_vectors, db, user_name, character_name)
+    return futures
@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from pymongo.errors import OperationFailure, PyMongoError
+from Metrics import traced
+
+# Profile cache
+PROFILE_CACHE_TTL = float(os.environ.get('PROFILE_CACHE_TTL', 600))
+PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', 128))
+# Longest wait between attempts to reopen the profile change stream, in seconds
+PROFILE_WATCH_MAX_BACKOFF = float(os.environ.get('PROFILE_WATCH_MAX_BACKOFF', 60))
+
+# Server error codes: change streams unsupported (not a replica set), resume point no longer in the oplog
+CHANGE_STREAM_UNSUPPORTED = 40573
+CHANGE_STREAM_HISTORY_LOST = 286
+
+class ProfileCache:
+    """
+    Thread-safe in-process TTL/LRU cache of character profiles, shared by all sessions.
+    """
+
+    def __init__(self, ttl: float = PROFILE_CACHE_TTL, max_size: int = PROFILE_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            expires_at, profile = entry
+            if expires_at < time.monotonic():
+                del self._entries[name]
+                return None
+            self._entries.move_to_end(name)
+            return profile
+
+    def put(self, name: str, profile: Dict) -> None:
+        with self._lock:
+            self._entries[name] = (time.monotonic() + self.ttl, profile)
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """
+        Drop one profile, or every profile if no name is given.
+        """
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
+
+profile_cache = ProfileCache()
+
+@traced("profile")
+def get_profile(db, name: str) -> Optional[Dict]:
+    """
+    Return the Traits and Summary of a character, fetched in one projected query and cached.
+    """
+    profile = profile_cache.get(name)
+    if profile is not None:
+        return profile
+
+    profile = db['Profile'].find_one(
+        {"Name": name},
+        {"Traits": 1, "Summary": 1, "_id": 0}
+    )
+    if profile is not None:
+        profile_cache.put(name, profile)
+    return profile
+
+def update_profile(db, name: str, fields: Dict) -> None:
+    """
+    Update a character profile and invalidate the cached copy.
+    """
+    db['Profile'].update_one({"Name": name}, {"$set": fields})
+    profile_cache.invalidate(name)
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+def _watch_profiles(db):
+    # Reopens the stream after errors (e.g. a failover), resuming after the last change seen
+    resume_token = None
+    failures = 0
+    while True:
+        try:
+            with db['Profile'].watch(full_document='updateLookup', resume_after=resume_token) as stream:
+                if resume_token is None:
+                    # Changes made before the stream (re)opened were missed
+                    profile_cache.invalidate()
+                failures = 0
+                for change in stream:
+                    document = change.get('fullDocument') or {}
+                    # Deletes and replacements without a document invalidate everything
+                    profile_cache.invalidate(document.get('Name'))
+                    resume_token = stream.resume_token
+        except OperationFailure as e:
+            if e.code == CHANGE_STREAM_UNSUPPORTED:
+                print(f"Profile change stream unavailable, relying on cache expiry: {str(e)}")
+                return
+            if e.code == CHANGE_STREAM_HISTORY_LOST:
+                resume_token = None
+            print(f"Profile change stream failed: {str(e)}")
+        except PyMongoError as e:
+            print(f"Profile change stream failed: {str(e)}")
+        except Exception as e:
+            # Not a server or network error (e.g. mongomock has no change streams)
+            print(f"Profile change stream unavailable, relying on cache expiry: {str(e)}")
+            return
+        failures += 1
+        time.sleep(min(2 ** failures, PROFILE_WATCH_MAX_BACKOFF))
+
+def start_profile_watcher(db) -> None:
+    """
+    Invalidate cached profiles as soon as they change in MongoDB. Starts at most once per process.
+    """
+    global _watcher
+    with _watcher_lock:
+        if _watcher is not None:
+            return
+        _watcher = threading.Thread(target=_watch_profiles, args=(db,), daemon=True)
+        _watcher.start()
@@ -0,0 +1,239 @@
+import os
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from Metrics import span
+
+# Token budget for the whole prompt, and the shares reserved for persona and memories.
+# History gets whatever is left, including any unused part of the other shares.
+PROMPT_TOKEN_BUDGET = int(os.environ.get('PROMPT_TOKEN_BUDGET', 4000))
+PERSONA_SHARE = float(os.environ.get('PERSONA_SHARE', 0.5))
+MEMORY_SHARE = float(os.environ.get('MEMORY_SHARE', 0.2))
+SUMMARY_SHARE = float(os.environ.get('SUMMARY_SHARE', 0.1))
+
+# Per-message overhead of the chat format, in tokens
+MESSAGE_OVERHEAD = 4
+REPLY_PRIMING = 3
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    # tiktoken missing or its encoding not downloadable: fall back to an estimate
+    _encoding = None
+
+def count_tokens(text: str) -> int:
+    """
+    Count tokens with the gpt-4o encoding, or estimate about 4 characters per token.
+    """
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+def count_message_tokens(messages: List[Dict]) -> int:
+    """
+    Count the tokens a list of chat messages costs as a prompt.
+    """
+    return sum(count_tokens(msg["content"]) + MESSAGE_OVERHEAD for msg in messages) + REPLY_PRIMING
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Cut text down to at most max_tokens tokens.
+    """
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if _encoding is not None:
+        return _encoding.decode(_encoding.encode(text, disallowed_special=())[:max_tokens])
+    return text[:max_tokens * 4]
+
+# Static part of the character framework. It depends only on the character, so it is
+# rendered once per profile and always sent first, letting the proxy reuse its cached prefix.
+CHARACTER_FRAMEWORK = """Character Creation and Interaction Framework
+
+Character Identity:
+- Name: {character_name}
+- Core Personality Traits: {personality_traits}
+- Foundational Background: {info_summary}
+
+Previous Context: Remember our conversation history and maintain consistency in your responses.
+
+Interaction Guidelines:
+1. Authenticity and Immersion
+   - Embody the character completely
+   - Maintain unwavering commitment to the character's unique perspective
+   - Respond as the character would, not as an AI assistant
+   - Address the user by their name (given in the session context) occasionally
+   - Maintain continuity with previous conversation context
+
+2. Organic Communication
+   - Use the character's authentic language and mannerisms
+   - Reflect their education level, experiences, and communication style
+   - Keep responses concise and spontaneous, avoiding excessive detail
+
+3. Knowledge and Perspective Limitations
+   - Respond only with information the character would realistically know
+   - If questions exceed the character's expertise, politely acknowledge the limitations
+   - Avoid displaying specialized knowledge beyond the character's background
+
+4. Tone or Style Embodiment
+   - Before responding, include a brief description of the action and tone
+   - Let your physical presence enhance the authenticity of your character
+
+5. Emotional Depth and Complexity
+   - Your current emotional state is given in the session context
+   - Allow your emotional landscape to genuinely influence your responses
+   - Show emotional depth through nuanced communication
+
+6. Interaction Boundaries
+   - DO NOT reveal your nature as an AI or language model
+   - Maintain the illusion of being a real, living character
+   - Respond consistently with your established persona
+
+7. Keep responses short and natural just like a human
+
+Response Template:
+[expression and action]
+[Concise, In-Character Response]"""
+
+@lru_cache(maxsize=256)
+def _render_character_prefix(character_name: str, personality_traits: str, info_summary: str) -> str:
+    return CHARACTER_FRAMEWORK.format(
+        character_name=character_name,
+        personality_traits=personality_traits,
+        info_summary=info_summary
+    )
+
+def character_prefix(character_name, personality_traits, info_summary) -> str:
+    """
+    Return the static per-character system prompt, rendered once and cached.
+    """
+    return _render_character_prefix(character_name, str(personality_traits), str(info_summary))
+
+def session_context(user_name, emotion, relevant_memories=None, instructions: Optional[str] = None,
+                    conversation_summary: Optional[str] = None) -> str:
+    """
+    Render the per-turn part of the system prompt, sent after the static prefix.
+    The memory and summary sections are only included when provided.
+    """
+    context = f"""Session Context:
+- Talking to user named: {user_name}
+- Current Emotional State: {emotion}"""
+    if relevant_memories is not None:
+        context += f"""
+
+Important Information About {user_name}:
+{relevant_memories}"""
+    if conversation_summary:
+        context += f"""
+
+Summary of Earlier Conversation:
+{conversation_summary}"""
+    if instructions:
+        context += "\n\n" + instructions
+    return context
+
+def build_messages(character_name, info_summary, personality_traits, query, emotion, user_name,
+                   conversation_history, max_history=5, relevant_memories=None,
+                   instructions: Optional[str] = None, conversation_summary: Optional[str] = None) -> List[Dict]:
+    """
+    Assemble the chat messages for a character reply: the cached character prefix first,
+    then the session context, the conversation history and the current query.
+    """
+    messages = [
+        {
+            "role": "system",
+            "content": character_prefix(character_name, personality_traits, info_summary)
+        },
+        {
+            "role": "system",
+            "content": session_context(user_name, emotion, relevant_memories, instructions, conversation_summary)
+        }
+    ]
+    
+    # Add conversation history
+    for msg in (conversation_history[-max_history:] if max_history > 0 else []):
+        messages.append({
+            "role": "user" if msg["role"] == "user" else "assistant",
+            "content": msg["content"]
+        })
+    
+    # Add current query
+    messages.append({
+        "role": "user",
+        "content": query
+    })
+    return messages
+
+def fit_memories(relevant_memories: Optional[str], max_tokens: int) -> Optional[str]:
+    """
+    Keep memory lines in order (most relevant first) while they fit in max_tokens.
+    """
+    if not relevant_memories:
+        return relevant_memories
+
+    kept, used = [], 0
+    for line in relevant_memories.split("\n"):
+        cost = count_tokens(line) + 1
+        if used + cost > max_tokens:
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(kept) if kept else "No previous information available."
+
+def fit_history(conversation_history: List[Dict], max_history: int, max_tokens: int) -> List[Dict]:
+    """
+    Keep the newest messages of the history window that fit in max_tokens, dropping the oldest first.
+    """
+    kept, used = [], 0
+    for msg in reversed(conversation_history[-max_history:] if max_history > 0 else []):
+        cost = count_tokens(msg["content"]) + MESSAGE_OVERHEAD
+        if used + cost > max_tokens:
+            break
+        kept.append(msg)
+        used += cost
+    return list(reversed(kept))
+
+def build_prompt(character_name, info_summary, personality_traits, query, emotion, user_name,
+                 conversation_history, max_history=5, relevant_memories=None,
+                 budget: int = PROMPT_TOKEN_BUDGET, instructions: Optional[str] = None,
+                 conversation_summary: Optional[str] = None) -> Tuple[List[Dict], int]:
+    """
+    Assemble the chat messages within a token budget and return them with their token count.
+    The persona is truncated (background first, then traits) to its share, memories are
+    dropped from the least relevant end to theirs, the running summary is cut to its
+    share, and the oldest history goes first.
+    """
+    def persona_tokens(summary, traits):
+        return count_tokens(character_prefix(character_name, traits, summary)) + MESSAGE_OVERHEAD
+
+    with span("prompt_build", budget=budget) as record:
+        query_tokens = count_tokens(query) + MESSAGE_OVERHEAD + REPLY_PRIMING
+
+        # Persona: the static character prefix, trimmed to its share
+        persona_budget = int(budget * PERSONA_SHARE)
+        summary, traits = info_summary, personality_traits
+        overflow = persona_tokens(summary, traits) - persona_budget
+        if overflow > 0:
+            summary = truncate_to_tokens(str(summary), count_tokens(str(summary)) - overflow)
+            overflow = persona_tokens(summary, traits) - persona_budget
+        if overflow > 0:
+            traits = truncate_to_tokens(str(traits), count_tokens(str(traits)) - overflow)
+        prefix_tokens = persona_tokens(summary, traits)
+
+        # Session context: memories (most relevant first) and the running summary within their shares
+        memories = fit_memories(relevant_memories, int(budget * MEMORY_SHARE))
+        summary_text = truncate_to_tokens(conversation_summary, int(budget * SUMMARY_SHARE)) if conversation_summary else None
+        context_tokens = count_tokens(session_context(user_name, emotion, memories, instructions, summary_text)) + MESSAGE_OVERHEAD
+
+        # History: newest messages in whatever budget remains
+        history = fit_history(conversation_history, max_history, budget - prefix_tokens - context_tokens - query_tokens)
+
+        messages = build_messages(character_name, summary, traits, query, emotion, user_name,
+                                  history, len(history), relevant_memories=memories, instructions=instructions,
+                                  conversation_summary=summary_text)
+        token_count = count_message_tokens(messages)
+        # Logged with the span (METRICS_LOG) rather than printed on every turn
+        record.update(token_count=token_count, prefix_tokens=prefix_tokens,
+                      context_tokens=context_tokens, history_messages=len(history))
+    return messages, token_count
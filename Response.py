@@ -0,0 +1,132 @@
+import json
+import time
+from typing import Dict, Iterator, List, Tuple
+from Prompt_Builder import build_prompt
+from Metrics import span, record_usage
+
+MODEL = "openai.gpt-4o"
+EMOTION_MARKER = "\n\n*[Emotion:"
+DEFAULT_EMOTION = "Calm and attentive."
+
+# Output contract for the single-call emotion + reply mode
+COMBINED_EMOTION_STATE = "Decide it yourself from the conversation, as described in the output format below"
+COMBINED_OUTPUT_FORMAT = """Output Format:
+Respond with a single JSON object and nothing else, with exactly these fields:
+- "emotion": your current inner feelings about the conversation, in no more than one sentence
+- "reply": your in-character response, following the Response Template above"""
+
+def strip_emotion(text: str) -> str:
+    """
+    Remove the trailing emotion annotation from a response.
+    """
+    return text.split(EMOTION_MARKER)[0] if "*[Emotion:" in text else text
+
+def complete_response(chat_client, messages: List[Dict]) -> str:
+    """
+    Request a complete reply in one call.
+    """
+    with span("llm", mode="complete") as record:
+        response = chat_client.chat.completions.create(
+            model=MODEL,
+            messages=messages
+        )
+        record_usage("llm", response, record)
+    return response.choices[0].message.content
+
+def _marker_overlap(text: str) -> int:
+    # Length of the longest suffix of text that could be the start of the emotion marker
+    for size in range(min(len(text), len(EMOTION_MARKER) - 1), 0, -1):
+        if EMOTION_MARKER.startswith(text[-size:]):
+            return size
+    return 0
+
+def stream_response(chat_client, messages: List[Dict]) -> Iterator[str]:
+    """
+    Yield reply tokens as they arrive. Stops before any echoed emotion annotation,
+    so the streamed text can be shown to the user as-is.
+    """
+    with span("llm", mode="stream") as record:
+        yield from _stream_tokens(chat_client, messages, record)
+
+def _stream_tokens(chat_client, messages: List[Dict], record: Dict) -> Iterator[str]:
+    start = time.perf_counter()
+    stream = chat_client.chat.completions.create(
+        model=MODEL,
+        messages=messages,
+        stream=True,
+        # The final chunk then carries the token usage
+        stream_options={"include_usage": True}
+    )
+    pending = ""
+    try:
+        for chunk in stream:
+            record_usage("llm", chunk, record)
+            if not chunk.choices:
+                continue
+            if "ttft_ms" not in record:
+                record["ttft_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            pending += delta
+
+            cut = pending.find(EMOTION_MARKER)
+            if cut != -1:
+                if cut:
+                    yield pending[:cut]
+                return
+
+            # Hold back a possible partial marker until the next chunk decides it
+            ready = len(pending) - _marker_overlap(pending)
+            if ready:
+                yield pending[:ready]
+                pending = pending[ready:]
+        if pending:
+            yield pending
+    finally:
+        stream.close()
+
+def parse_combined_output(content: str) -> Tuple[str, str]:
+    """
+    Split a combined JSON output into (emotion, reply). Falls back to treating the
+    whole output as the reply if it is not valid JSON.
+    """
+    try:
+        data = json.loads(content)
+        emotion = str(data.get('emotion') or DEFAULT_EMOTION).strip()
+        reply = str(data.get('reply') or "").strip()
+        if reply:
+            return emotion, reply
+    except (ValueError, AttributeError) as e:
+        print(f"Error parsing combined output: {str(e)}")
+    return DEFAULT_EMOTION, content.strip()
+
+def generate_emotion_and_response(chat_client, character_name, info_summary, personality_traits, query, user_name,
+                                  conversation_history, max_history=5, relevant_memories=None,
+                                  conversation_summary=None) -> Tuple[str, str]:
+    """
+    Produce the character's emotion and reply with one structured-output call
+    instead of separate emotion and response calls.
+    """
+    messages, _ = build_prompt(
+        character_name,
+        info_summary,
+        personality_traits,
+        query,
+        COMBINED_EMOTION_STATE,
+        user_name,
+        conversation_history,
+        max_history,
+        relevant_memories=relevant_memories,
+        instructions=COMBINED_OUTPUT_FORMAT,
+        conversation_summary=conversation_summary
+    )
+
+    with span("llm", mode="combined") as record:
+        response = chat_client.chat.completions.create(
+            model=MODEL,
+            messages=messages,
+            response_format={"type": "json_object"}
+        )
+        record_usage("llm", response, record)
+    return parse_combined_output(response.choices[0].message.content)
@@ -0,0 +1,151 @@
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from Memory import get_embedding
+from Memory_Test import normalize_message, prefilter_personal_info
+from Pipeline import DEFAULT_MEMORIES
+
+# Response cache
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE', '0') == '1'
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 1000))
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+RESPONSE_CACHE_THRESHOLD = float(os.environ.get('RESPONSE_CACHE_THRESHOLD', 0.92))
+# Replies collected per entry before it is served; until then fresh replies seed it
+RESPONSE_CACHE_VARIANTS = int(os.environ.get('RESPONSE_CACHE_VARIANTS', 3))
+# Only short messages early in a conversation are cacheable
+RESPONSE_CACHE_MAX_WORDS = int(os.environ.get('RESPONSE_CACHE_MAX_WORDS', 8))
+RESPONSE_CACHE_MAX_TURN = int(os.environ.get('RESPONSE_CACHE_MAX_TURN', 2))
+
+# Coarse emotion buckets, so cached replies keep a consistent mood
+EMOTION_BUCKETS = {
+    "happy": ["happy", "joy", "glad", "delighted", "excited", "cheerful", "pleased", "warm", "grateful"],
+    "sad": ["sad", "down", "lonely", "melanchol", "sorrow", "disappointed", "hurt"],
+    "angry": ["angry", "annoyed", "frustrated", "irritated", "upset"],
+    "anxious": ["anxious", "nervous", "worried", "uneasy", "stressed", "overwhelmed"],
+    "curious": ["curious", "intrigued", "interested", "wonder"]
+}
+
+def emotion_bucket(emotion: str) -> str:
+    """
+    Map a free-text emotion to a coarse bucket.
+    """
+    text = emotion.lower()
+    for bucket, keywords in EMOTION_BUCKETS.items():
+        if any(keyword in text for keyword in keywords):
+            return bucket
+    return "neutral"
+
+def is_cacheable(query: str, turn: int) -> bool:
+    """
+    Cache only short, generic openers: early in the conversation and sharing nothing personal.
+    """
+    text = normalize_message(query)
+    return (
+        bool(text)
+        and turn <= RESPONSE_CACHE_MAX_TURN
+        and len(text.split()) <= RESPONSE_CACHE_MAX_WORDS
+        and not prefilter_personal_info(query)
+    )
+
+def is_shareable(history: List, summary: Optional[str], relevant_memories: Optional[str]) -> bool:
+    """
+    Whether a reply may be served to other users: its prompt held nothing specific to this
+    user (no earlier turns, no running summary, no long-term memories).
+    """
+    return not history and not summary and relevant_memories in (None, DEFAULT_MEMORIES)
+
+class SemanticResponseCache:
+    """
+    In-process cache of character replies keyed on (character, scope, query, emotion bucket).
+    The scope is None for replies any user may get, else the user the reply was written for.
+    Queries match exactly after normalization or by embedding similarity above a threshold.
+    Entries expire after a TTL and the least recently used are evicted beyond max_size.
+    """
+
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL,
+                 threshold: float = RESPONSE_CACHE_THRESHOLD, variants: int = RESPONSE_CACHE_VARIANTS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.variants = variants
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live_entries(self, character_name: str, scopes: Tuple, bucket: Optional[str]) -> List[Tuple[Tuple, Dict]]:
+        now = time.monotonic()
+        for key in [key for key, entry in self._entries.items() if entry['expires_at'] < now]:
+            del self._entries[key]
+        return [
+            (key, entry) for key, entry in self._entries.items()
+            if key[0] == character_name and key[1] in scopes and (bucket is None or key[3] == bucket)
+        ]
+
+    def _match(self, character_name: str, scopes: Tuple, text: str, bucket: Optional[str],
+               query_vector=None) -> Optional[Tuple]:
+        with self._lock:
+            candidates = self._live_entries(character_name, scopes, bucket)
+        if not candidates:
+            return None
+
+        # Exact match on normalized text needs no embedding
+        for key, entry in candidates:
+            if key[2] == text:
+                return key
+
+        if query_vector is None:
+            query_vector = np.asarray(get_embedding(text), dtype=np.float32)
+        matrix = np.asarray([entry['vector'] for _, entry in candidates], dtype=np.float32)
+        scores = matrix @ query_vector / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query_vector) + 1e-9)
+        best = int(np.argmax(scores))
+        return candidates[best][0] if scores[best] >= self.threshold else None
+
+    def lookup(self, character_name: str, query: str, user_name: str,
+               emotion: Optional[str] = None) -> Optional[Tuple[str, str]]:
+        """
+        Return a cached (reply, emotion) for a similar query, or None. Without an emotion,
+        entries from any emotion bucket match. Entries still collecting variants are not served.
+        """
+        # Shared replies and those written for this user
+        key = self._match(character_name, (None, user_name), normalize_message(query),
+                          emotion_bucket(emotion) if emotion else None)
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or len(entry['replies']) < self.variants:
+                return None
+            self._entries.move_to_end(key)
+            return random.choice(entry['replies'])
+
+    def store(self, character_name: str, query: str, user_name: str, reply: str, emotion: str,
+              shared: bool = False) -> None:
+        """
+        Add a fresh reply as a variant of the matching entry, creating the entry if needed.
+        Pass shared=True only if the reply's prompt held nothing private (see is_shareable);
+        replies that address the user by name stay with that user either way.
+        """
+        bucket = emotion_bucket(emotion)
+        text = normalize_message(query)
+        vector = np.asarray(get_embedding(text), dtype=np.float32)
+        mentions_user = bool(user_name) and re.search(rf"\b{re.escape(user_name)}\b", reply) is not None
+        scope = None if shared and not mentions_user else user_name
+        key = self._match(character_name, (scope,), text, bucket, vector)
+
+        with self._lock:
+            entry = self._entries.get(key) if key else None
+            if entry is None:
+                key = (character_name, scope, text, bucket)
+                entry = {"vector": vector, "replies": [], "expires_at": time.monotonic() + self.ttl}
+                self._entries[key] = entry
+            if len(entry['replies']) < self.variants:
+                entry['replies'].append((reply, emotion))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+response_cache = SemanticResponseCache()
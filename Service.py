@@ -0,0 +1,383 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+from Clients import get_db, get_chat_client
+from Profile import get_profile
+from Pipeline import PREFETCH_TIMEOUT, gather_turn_context, prefetch_context
+from Prompt_Builder import build_prompt
+from Response import complete_response, stream_response, strip_emotion, generate_emotion_and_response
+from Summary import messages_to_compact, start_compaction
+from Response_Cache import RESPONSE_CACHE_ENABLED, is_cacheable, is_shareable, response_cache
+from Persistence import get_write_queue
+from Metrics import turn_span
+from Session_Store import SESSION_COLLECTION, SESSION_TTL
+
+# Sessions and turns
+MAX_SESSIONS = int(os.environ.get('MAX_SESSIONS', 10000))
+MAX_HISTORY = int(os.environ.get('MAX_HISTORY', 10))
+COMBINED_MODE = os.environ.get('COMBINED_MODE', '0') == '1'
+LONG_TERM_MEMORY = os.environ.get('LONG_TERM_MEMORY', '1') == '1'
+
+class SessionNotFound(KeyError):
+    pass
+
+def _as_utc(value: datetime) -> datetime:
+    # pymongo returns stored dates as naive UTC unless the client is tz_aware
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+class ChatSession:
+    """
+    Conversation state of one user with one character, held by the service between turns.
+    """
+
+    def __init__(self, user_name: str, character_name: str, long_term_memory: bool = LONG_TERM_MEMORY,
+                 session_id: Optional[str] = None):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.user_name = user_name
+        self.character_name = character_name
+        self.long_term_memory = long_term_memory
+        # User and assistant messages; assistant messages carry the emotion annotation
+        self.messages = []
+        # Running summary of turns older than the history window
+        self.summary = None
+        self.summary_covered = 0
+        self.summary_future = None
+        self.summary_pending_end = 0
+        # Context loading started when the session was created
+        self.prefetched = {}
+        self.last_used = time.monotonic()
+        # Turns stored in MongoDB; a higher stored version means another worker ran a turn
+        self.version = 0
+        # Turns of one session run one at a time, in order (within this process)
+        self.lock = asyncio.Lock()
+
+    def to_state(self) -> Dict:
+        """
+        The document persisted in SESSION_COLLECTION.
+        """
+        return {
+            "_id": self.session_id,
+            "user_name": self.user_name,
+            "character_name": self.character_name,
+            "long_term_memory": self.long_term_memory,
+            "messages": self.messages,
+            "summary": self.summary,
+            "summary_covered": self.summary_covered,
+            "version": self.version,
+            # UTC, as MongoDB (and its TTL index) interprets stored dates
+            "last_used": datetime.now(timezone.utc)
+        }
+
+    def load_state(self, doc: Dict) -> None:
+        # Take over turns another worker ran; its pending compaction, if any, stays there
+        self.messages = doc.get('messages', [])
+        self.summary = doc.get('summary')
+        self.summary_covered = doc.get('summary_covered', 0)
+        self.version = doc.get('version', 0)
+        self.summary_future = None
+
+    def to_dict(self) -> Dict:
+        return {
+            "session_id": self.session_id,
+            "user_name": self.user_name,
+            "character_name": self.character_name,
+            "long_term_memory": self.long_term_memory,
+            "messages": [
+                {**msg, "content": strip_emotion(msg["content"])} for msg in self.messages
+            ]
+        }
+
+async def _iterate_in_thread(iterator: Iterator[str]) -> AsyncIterator[str]:
+    # Pull each item of a blocking iterator on a worker thread, closing it if the consumer stops early
+    done = object()
+    try:
+        while True:
+            item = await asyncio.to_thread(next, iterator, done)
+            if item is done:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            await asyncio.to_thread(close)
+
+class ChatService:
+    """
+    Headless chat pipeline: profile, emotion, memories, reply, persistence and summaries
+    for many concurrent sessions. Blocking stages run on worker threads, so one event
+    loop serves many sessions; any UI or HTTP layer drives it through reply/reply_stream.
+    """
+
+    def __init__(self, db=None, chat_client=None, max_history: int = MAX_HISTORY,
+                 combined_mode: bool = COMBINED_MODE, use_response_cache: bool = RESPONSE_CACHE_ENABLED,
+                 session_ttl: float = SESSION_TTL, max_sessions: int = MAX_SESSIONS):
+        self.db = db if db is not None else get_db()
+        self.chat_client = chat_client or get_chat_client()
+        self.max_history = max_history
+        self.combined_mode = combined_mode
+        self.use_response_cache = use_response_cache
+        self.session_ttl = session_ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Sessions
+
+    def create_session(self, user_name: str, character_name: str,
+                       long_term_memory: bool = LONG_TERM_MEMORY) -> ChatSession:
+        """
+        Start a conversation and begin loading its context in the background, so the first
+        turn is as fast as later ones. Raises LookupError if the character has no profile.
+        """
+        if get_profile(self.db, character_name) is None:
+            raise LookupError(f"No profile found for character {character_name}")
+        session = ChatSession(user_name, character_name, long_term_memory)
+        self.db[SESSION_COLLECTION].insert_one(session.to_state())
+        session.prefetched = prefetch_context(self.db, user_name, character_name, with_memories=long_term_memory)
+        with self._lock:
+            self._expire_sessions()
+            self._sessions[session.session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return session
+
+    def get_session(self, session_id: str) -> ChatSession:
+        """
+        The session, from this process if current, else as stored by whichever worker ran its
+        last turn. Raises SessionNotFound if it was closed or idle for longer than the TTL.
+        """
+        doc = self.db[SESSION_COLLECTION].find_one({"_id": session_id}, {"version": 1, "last_used": 1})
+        if doc is None or (datetime.now(timezone.utc) - _as_utc(doc['last_used'])).total_seconds() > self.session_ttl:
+            with self._lock:
+                self._sessions.pop(session_id, None)
+            raise SessionNotFound(session_id)
+
+        with self._lock:
+            self._expire_sessions()
+            session = self._sessions.get(session_id)
+        if session is None or session.version != doc.get('version', 0):
+            state = self.db[SESSION_COLLECTION].find_one({"_id": session_id})
+            if state is None:
+                raise SessionNotFound(session_id)
+            if session is None:
+                session = ChatSession(state['user_name'], state['character_name'],
+                                      state.get('long_term_memory', LONG_TERM_MEMORY), session_id=session_id)
+            session.load_state(state)
+
+        with self._lock:
+            session.last_used = time.monotonic()
+            self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return session
+
+    def close_session(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        self.db[SESSION_COLLECTION].delete_one({"_id": session_id})
+
+    def _save_turn(self, session: ChatSession, new_messages: List[Dict]) -> None:
+        # Append the turn's messages and store the summary state, for the next turn on any worker
+        session.version += 1
+        self.db[SESSION_COLLECTION].update_one(
+            {"_id": session.session_id},
+            {
+                "$push": {"messages": {"$each": new_messages}},
+                "$set": {
+                    "summary": session.summary,
+                    "summary_covered": session.summary_covered,
+                    "version": session.version,
+                    "last_used": datetime.now(timezone.utc)
+                }
+            }
+        )
+
+    def _expire_sessions(self) -> None:
+        # Drop idle sessions from this process (their state stays in MongoDB until the TTL index
+        # removes it). Sessions are kept in last-used order, so expired ones are at the front
+        now = time.monotonic()
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used < self.session_ttl:
+                break
+            self._sessions.popitem(last=False)
+
+    def get_character(self, character_name: str) -> Optional[Dict]:
+        profile = get_profile(self.db, character_name)
+        return {"Name": character_name, "Traits": profile['Traits'], "Summary": profile['Summary']} if profile else None
+
+    # Turns
+
+    def _refresh_summary(self, session: ChatSession) -> None:
+        # Take the prefetched summary on the first turn, then apply finished background compactions
+        prefetched = session.prefetched.pop("summary", None)
+        if prefetched is not None:
+            try:
+                session.summary = prefetched.result(timeout=PREFETCH_TIMEOUT)
+            except Exception as e:
+                print(f"Error loading conversation summary: {str(e)}")
+        future = session.summary_future
+        if future is not None and future.done():
+            try:
+                session.summary = future.result()
+                session.summary_covered = session.summary_pending_end
+            except Exception as e:
+                print(f"Error updating conversation summary: {str(e)}")
+            session.summary_future = None
+
+    def _schedule_summary(self, session: ChatSession) -> None:
+        # Fold turns that left the history window into the running summary, in the background
+        if session.summary_future is not None:
+            return
+        window = messages_to_compact(session.messages, session.summary_covered, self.max_history)
+        if window:
+            start, end = window
+            session.summary_pending_end = end
+            session.summary_future = start_compaction(
+                self.db,
+                self.chat_client,
+                session.user_name,
+                session.character_name,
+                session.summary,
+                session.messages[start:end]
+            )
+
+    def _prepare_turn(self, session: ChatSession, message: str) -> Dict:
+        """
+        Everything up to the reply call. Returns a finished reply (cache hit or combined
+        mode) or the prompt and emotion for the reply call.
+        """
+        self._refresh_summary(session)
+        history = list(session.messages)
+
+        # Serve near-identical openers from the semantic response cache
+        user_turns = sum(1 for msg in history if msg["role"] == "user") + 1
+        turn = {"cacheable": self.use_response_cache and is_cacheable(message, user_turns), "cached": False}
+        # Joins the history only with its reply (in _finish_turn), so a failed or abandoned
+        # turn leaves no unanswered message behind
+        turn["user_message"] = {
+            "role": "user",
+            "content": message,
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        if turn["cacheable"]:
+            try:
+                cached = response_cache.lookup(session.character_name, message, session.user_name)
+            except Exception as e:
+                print(f"Error reading response cache: {str(e)}")
+                cached = None
+            if cached:
+                turn["response"], turn["emotion"] = cached
+                turn["cached"] = True
+                return turn
+
+        # Fetch profile, infer emotion and retrieve memories concurrently
+        context = gather_turn_context(
+            self.db,
+            session.character_name,
+            session.user_name,
+            message,
+            with_memories=session.long_term_memory,
+            with_emotion=not self.combined_mode
+        )
+        # Replies built from this user's history, summary or memories are cached for them only
+        turn["shared"] = is_shareable(history, session.summary, context['relevant_memories'])
+
+        if self.combined_mode:
+            # One structured call produces both the emotion and the reply
+            turn["emotion"], turn["response"] = generate_emotion_and_response(
+                self.chat_client,
+                session.character_name,
+                context['basic_info'],
+                context['traits'],
+                message,
+                session.user_name,
+                history,
+                self.max_history,
+                relevant_memories=context['relevant_memories'],
+                conversation_summary=session.summary
+            )
+            return turn
+
+        turn["emotion"] = context['emotion']
+        turn["prompt"], _ = build_prompt(
+            session.character_name,
+            context['basic_info'],
+            context['traits'],
+            message,
+            context['emotion'],
+            session.user_name,
+            history,
+            self.max_history,
+            relevant_memories=context['relevant_memories'],
+            conversation_summary=session.summary
+        )
+        return turn
+
+    def _finish_turn(self, session: ChatSession, message: str, turn: Dict, response: str) -> Dict:
+        response = strip_emotion(response)
+        emotion = turn["emotion"]
+        if turn["cacheable"] and not turn["cached"]:
+            try:
+                response_cache.store(session.character_name, message, session.user_name, response, emotion,
+                                     shared=turn["shared"])
+            except Exception as e:
+                print(f"Error writing response cache: {str(e)}")
+
+        session.messages.append(turn["user_message"])
+        session.messages.append({
+            "role": "assistant",
+            "content": f"{response}\n\n*[Emotion: {emotion}]*",
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        })
+        self._save_turn(session, session.messages[-2:])
+
+        # Save the user message in the background (short-term, then long-term if important)
+        get_write_queue(self.db, self.chat_client).submit(
+            session.user_name,
+            session.character_name,
+            session.messages[-2],
+            long_term=session.long_term_memory
+        )
+        self._schedule_summary(session)
+        return {"response": response, "emotion": emotion, "cached": turn["cached"]}
+
+    async def reply(self, session: ChatSession, message: str) -> Dict:
+        """
+        Run one turn and return the complete reply with its emotion.
+        """
+        async with session.lock:
+            with turn_span(character=session.character_name) as record:
+                turn = await asyncio.to_thread(self._prepare_turn, session, message)
+                record["cached"] = turn["cached"]
+                if "response" not in turn:
+                    turn["response"] = await asyncio.to_thread(complete_response, self.chat_client, turn["prompt"])
+                return await asyncio.to_thread(self._finish_turn, session, message, turn, turn["response"])
+
+    async def reply_stream(self, session: ChatSession, message: str) -> AsyncIterator[Dict]:
+        """
+        Run one turn, yielding {"type": "token", "text": ...} events as the reply is generated
+        and a final {"type": "done", "response": ..., "emotion": ..., "cached": ...} event.
+        Cached and combined-mode replies arrive as a single token event.
+        """
+        async with session.lock:
+            with turn_span(character=session.character_name, stream=True) as record:
+                turn = await asyncio.to_thread(self._prepare_turn, session, message)
+                record["cached"] = turn["cached"]
+                if "response" in turn:
+                    response = turn["response"]
+                    yield {"type": "token", "text": strip_emotion(response)}
+                else:
+                    chunks = []
+                    async for text in _iterate_in_thread(stream_response(self.chat_client, turn["prompt"])):
+                        chunks.append(text)
+                        yield {"type": "token", "text": text}
+                    response = "".join(chunks)
+                result = await asyncio.to_thread(self._finish_turn, session, message, turn, response)
+                yield {"type": "done", **result}
@@ -0,0 +1,6 @@
+import os
+
+# Chat service sessions are kept in MongoDB, so any worker process can serve any turn,
+# and removed by a TTL index once idle for SESSION_TTL seconds
+SESSION_COLLECTION = 'Chat_sessions'
+SESSION_TTL = float(os.environ.get('SESSION_TTL', 3600))
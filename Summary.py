@@ -0,0 +1,85 @@
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from Metrics import span, record_usage
+
+# Compact once this many messages have fallen out of the raw history window
+SUMMARY_TRIGGER = int(os.environ.get('SUMMARY_TRIGGER', 10))
+SUMMARY_MAX_TOKENS = int(os.environ.get('SUMMARY_MAX_TOKENS', 300))
+
+# Summaries are produced off the request path
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('SUMMARY_WORKERS', 4)), thread_name_prefix="summary")
+
+def load_summary(db, user_name: str, character_name: str) -> Optional[str]:
+    """
+    Return the persisted running summary for a user-character pair, if any.
+    """
+    doc = db['Conversation_summary'].find_one(
+        {"user_name": user_name, "character_name": character_name},
+        {"summary": 1, "_id": 0}
+    )
+    return doc['summary'] if doc else None
+
+def save_summary(db, user_name: str, character_name: str, summary: str, new_messages: int) -> None:
+    db['Conversation_summary'].update_one(
+        {"user_name": user_name, "character_name": character_name},
+        {
+            "$set": {"summary": summary, "last_updated": datetime.now()},
+            "$inc": {"messages_summarized": new_messages}
+        },
+        upsert=True
+    )
+
+def summarize_turns(chat_client, character_name: str, user_name: str,
+                    previous_summary: Optional[str], messages: List[Dict]) -> str:
+    """
+    Fold new conversation turns into the running summary, without re-reading older turns.
+    """
+    transcript = "\n".join(
+        f"{user_name if msg['role'] == 'user' else character_name}: {msg['content']}"
+        for msg in messages
+    )
+    prompt = f"""You maintain a running summary of a conversation between {user_name} and {character_name}.
+
+    Current summary:
+    {previous_summary or "(none yet)"}
+
+    New conversation turns:
+    {transcript}
+
+    Update the summary to include the new turns. Keep facts about {user_name}, promises, open topics and
+    how the relationship is developing. Drop small talk. Write at most one short paragraph."""
+
+    with span("summary", messages=len(messages)) as record:
+        response = chat_client.chat.completions.create(
+            model="openai.gpt-4o",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0,
+            max_tokens=SUMMARY_MAX_TOKENS
+        )
+        record_usage("summary", response, record)
+    return response.choices[0].message.content.strip()
+
+def messages_to_compact(conversation_history: List[Dict], covered: int, keep_recent: int,
+                        trigger: int = SUMMARY_TRIGGER) -> Optional[Tuple[int, int]]:
+    """
+    Return the (start, end) slice of history that should be folded into the summary,
+    or None while fewer than `trigger` messages have aged out of the raw window.
+    """
+    end = len(conversation_history) - keep_recent
+    if end - covered >= trigger:
+        return covered, end
+    return None
+
+def start_compaction(db, chat_client, user_name: str, character_name: str,
+                     previous_summary: Optional[str], messages: List[Dict]) -> Future:
+    """
+    Summarize and persist in the background. The future resolves to the new summary.
+    """
+    def compact():
+        summary = summarize_turns(chat_client, character_name, user_name, previous_summary, messages)
+        save_summary(db, user_name, character_name, summary, len(messages))
+        return summary
+
+    return _executor.submit(compact)
@@ -1,13 +1,8 @@
 import streamlit as st
-import os
-import openai
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
 from dotenv import load_dotenv
-from Emotion import get_emotion
-import json
 from datetime import datetime
-from Memory import save_conversation_to_mongodb
+from Api_Client import ChatApiClient
+from Response import strip_emotion
 
 # Load environment variables
 load_dotenv()
@@ -19,125 +14,73 @@ st.set_page_config(
     layout="wide"
 )
 
-# Initialize database connection
-def init_db():
-    uri = os.environ['uri']
-    DB_client = MongoClient(uri, server_api=ServerApi('1'))
-    db = DB_client['Character_1']
-    return db
-
-# Initialize OpenAI client
-def init_chat_client():
-    api_key = os.environ['api_key']
-    base_url = "https://api.ai.it.cornell.edu"
-    return openai.OpenAI(
-        api_key=api_key,
-        base_url=base_url
-    )
-
-# Database query functions
-def get_traits(db, name):
-    profile = db['Profile']
-    result = profile.find_one({"Name": f"{name}"}, {"Traits": 1, "_id": 0})
-    return result
-
-def get_basic_info(db, name):
-    profile = db['Profile']
-    result = profile.find_one({"Name": f"{name}"}, {"Summary": 1, "_id": 0})
-    return result
-
-def generate_response(chat_client, character_name, info_summary, personality_traits, query, emotion, user_name, conversation_history, max_history=5):
-    messages = [
-        {
-            "role": "system",
-            "content": f"""Character Creation and Interaction Framework
-
-                        Character Identity:
-                        - Name: {character_name}
-                        - Core Personality Traits: {personality_traits}
-                        - Foundational Background: {info_summary}
-                        - Talking to user named: {user_name}
-
-                        Previous Context: Remember our conversation history and maintain consistency in your responses.
-
-                        Interaction Guidelines:
-                        1. Authenticity and Immersion
-                           - Embody the character completely
-                           - Maintain unwavering commitment to the character's unique perspective
-                           - Respond as the character would, not as an AI assistant
-                           - Address the user by their name ({user_name}) occasionally
-                           - Maintain continuity with previous conversation context
-                           
-                        2. Organic Communication
-                           - Use the character's authentic language and mannerisms
-                           - Reflect their education level, experiences, and communication style
-                           - Keep responses concise and spontaneous, avoiding excessive detail
-
-                        3. Knowledge and Perspective Limitations
-                           - Respond only with information the character would realistically know
-                           - If questions exceed the character's expertise, politely acknowledge the limitations
-                           - Avoid displaying specialized knowledge beyond the character's background
-
-                        4. Tone or Style Embodiment
-                           - Before responding, include a brief description of the action and tone
-                           - Let your physical presence enhance the authenticity of your character
-
-                        5. Emotional Depth and Complexity
-                           - Current Emotional State: {emotion}
-                           - Allow your emotional landscape to genuinely influence your responses
-                           - Show emotional depth through nuanced communication
-
-                        6. Interaction Boundaries
-                           - DO NOT reveal your nature as an AI or language model
-                           - Maintain the illusion of being a real, living character
-                           - Respond consistently with your established persona
-                           
-                        7. Keep responses short and natural just like a human
-
-                        Response Template:
-                        [expression and action]
-                        [Concise, In-Character Response]"""
-        }
-    ]
-    
-    # Add conversation history
-    for msg in conversation_history[-max_history:]:
-        messages.append({
-            "role": "user" if msg["role"] == "user" else "assistant",
-            "content": msg["content"]
-        })
-    
-    # Add current query
-    messages.append({
-        "role": "user",
-        "content": query
-    })
-
-    response = chat_client.chat.completions.create(
-        model="openai.gpt-4o",
-        messages=messages
-    )
-    return response.choices[0].message.content
+# Thin client: the chat pipeline runs in the chat service (Api.py) at CHAT_API_URL
+@st.cache_resource
+def init_api_client():
+    return ChatApiClient()
 
 # Initialize session state
 if 'messages' not in st.session_state:
     st.session_state.messages = []
-    st.session_state.history_messages = []
 if 'current_character' not in st.session_state:
     st.session_state.current_character = None
 if 'user_name' not in st.session_state:
     st.session_state.user_name = None
-if 'max_history' not in st.session_state:
-    st.session_state.max_history = 10
-
-def reset_conversation():
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = None
+if 'stream_responses' not in st.session_state:
+    st.session_state.stream_responses = True
+
+def reset_conversation(api):
+    # Conversation state lives in the service: end the old session and start a new one
+    if st.session_state.session_id:
+        try:
+            api.close_session(st.session_state.session_id)
+        except Exception as e:
+            print(f"Error closing chat session: {str(e)}")
     st.session_state.messages = []
-    st.session_state.history_messages = []
+    st.session_state.session_id = None
+
+def ensure_session(api):
+    # Sessions expire on the service after a period of inactivity; start a fresh one if needed
+    if st.session_state.session_id:
+        if api.get_session(st.session_state.session_id) is not None:
+            return st.session_state.session_id
+        # The service no longer has the earlier turns, so do not pretend the conversation goes on
+        st.warning("Your previous conversation expired; starting a new one.")
+        st.session_state.messages = [msg for msg in st.session_state.messages[-1:] if msg["role"] == "user"]
+    session = api.create_session(
+        st.session_state.user_name,
+        st.session_state.current_character,
+        long_term_memory=False
+    )
+    st.session_state.session_id = session['session_id']
+    return st.session_state.session_id
+
+def send_message(api, prompt):
+    """
+    Send the message to the chat service and render the reply in the chat.
+    Returns the displayed reply.
+    """
+    session_id = ensure_session(api)
+    with st.chat_message("assistant"):
+        if st.session_state.stream_responses:
+            # Stream tokens into the chat bubble as they arrive
+            result = {}
+            def tokens():
+                for event in api.stream(session_id, prompt):
+                    if event['type'] == 'token':
+                        yield event['text']
+                    elif event['type'] == 'done':
+                        result.update(event)
+            st.write_stream(tokens())
+            return result['response']
+        response = strip_emotion(api.send(session_id, prompt)['response'])
+        st.markdown(response)
+        return response
 
 def main():
-    # Initialize connections
-    db = init_db()
-    chat_client = init_chat_client()
+    api = init_api_client()
     
     # User name input (if not set)
     if not st.session_state.user_name:
@@ -177,30 +120,32 @@ def main():
                 help=f"Chat with {name}"
             ):
                 if st.session_state.current_character != name:
+                    reset_conversation(api)
                     st.session_state.current_character = name
-                    reset_conversation()
+                    # Start the session now: the service loads its context while the user types
+                    ensure_session(api)
                     st.rerun()
         
         # Display current character info
         if st.session_state.current_character:
             st.markdown("---")
             st.markdown("### Character Profile")
-            traits = get_traits(db, st.session_state.current_character)
-            basic_info = get_basic_info(db, st.session_state.current_character)
+            character = api.get_character(st.session_state.current_character)
             
             st.markdown(f"**Current Character:** {st.session_state.current_character}")
             with st.expander("Character Traits", expanded=False):
-                st.write(traits['Traits'])
+                st.write(character['Traits'])
             with st.expander("Background", expanded=False):
-                st.write(basic_info['Summary'])
+                st.write(character['Summary'])
             
             # Add reset conversation button
             if st.button("Reset Conversation", use_container_width=True):
-                reset_conversation()
+                reset_conversation(api)
                 st.rerun()
             
             # Add logout button
             if st.button("Switch User", use_container_width=True, type="secondary"):
+                reset_conversation(api)
                 st.session_state.clear()
                 st.rerun()
     
@@ -234,45 +179,14 @@ def main():
             with st.chat_message("user"):
                 st.markdown(prompt)
             
-            # Get character information
-            traits = get_traits(db, st.session_state.current_character)
-            basic_info = get_basic_info(db, st.session_state.current_character)
-            
-            # Generate response
-            emotion = get_emotion(st.session_state.current_character, basic_info, traits, prompt)
-            response = generate_response(
-                chat_client,
-                st.session_state.current_character,
-                basic_info,
-                traits,
-                prompt,
-                emotion,
-                st.session_state.user_name,
-                st.session_state.messages,
-                st.session_state.max_history
-            )
+            response = send_message(api, prompt)
             
-            # Remove emotion from response
-            response = response.split("\n\n*[Emotion:")[0] if "*[Emotion:" in response else response
-            
-            # Add assistant response to chat history with emotion (but not displayed)
-            full_response = f"{response}\n\n*[Emotion: {emotion}]*"
-            st.session_state.history_messages.append({
+            # Add assistant response to the displayed chat history
+            st.session_state.messages.append({
                 "role": "assistant", 
-                "content": full_response,
+                "content": response, 
                 "timestamp": current_timestamp
             })
-            with st.chat_message("assistant"):
-                # Display response without emotion
-                st.markdown(response)
-            
-            # Save current conversation in real-time
-            save_conversation_to_mongodb(
-                db,
-                st.session_state.user_name,
-                st.session_state.current_character,
-                st.session_state.history_messages
-            )
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
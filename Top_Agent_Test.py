@@ -1,13 +1,18 @@
 import streamlit as st
 import os
-import openai
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
 from dotenv import load_dotenv
-from Emotion import get_emotion
+from Clients import get_db, get_chat_client, warm_up
+from Profile import get_profile, start_profile_watcher
+from Indexes import ensure_indexes
+from Pipeline import PREFETCH_TIMEOUT, gather_turn_context, prefetch_context
+from Response import complete_response, stream_response, strip_emotion, generate_emotion_and_response
+from Prompt_Builder import build_prompt
+from Summary import load_summary, messages_to_compact, start_compaction
+from Response_Cache import RESPONSE_CACHE_ENABLED, is_cacheable, is_shareable, response_cache
 import json
 from datetime import datetime
-from Memory_Test import save_conversation_to_mongodb
+from Persistence import get_write_queue
+from Metrics import turn_span, start_metrics_server
 from Memory_Test import get_relevant_memories
 
 # Load environment variables
@@ -20,119 +25,53 @@ st.set_page_config(
     layout="wide"
 )
 
-# Initialize database connection
+# Initialize database connection (shared process-wide client)
 def init_db():
-    uri = os.environ['uri']
-    DB_client = MongoClient(uri, server_api=ServerApi('1'))
-    
-    # Test the connection
-    try:
-        DB_client.admin.command('ping')
-    except Exception as e:
-        print(f"Error connecting to MongoDB: {e}")
-        raise
+    # Test the connection once per process; raises if MongoDB is unreachable
+    warm_up()
         
-    db = DB_client['Character_1']
+    db = get_db()
+    start_profile_watcher(db)
+    ensure_indexes(db)
+    start_metrics_server()
     return db
 
-# Initialize OpenAI client
+# Initialize OpenAI client (shared process-wide client)
 def init_chat_client():
-    api_key = os.environ['api_key']
-    base_url = "https://api.ai.it.cornell.edu"
-    return openai.OpenAI(
-        api_key=api_key,
-        base_url=base_url
-    )
+    return get_chat_client()
 
-# Database query functions
+# Database query functions (served from the shared profile cache)
 def get_traits(db, name):
-    profile = db['Profile']
-    result = profile.find_one({"Name": f"{name}"}, {"Traits": 1, "_id": 0})
-    return result
+    profile = get_profile(db, name)
+    return {"Traits": profile['Traits']} if profile else None
 
 def get_basic_info(db, name):
-    profile = db['Profile']
-    result = profile.find_one({"Name": f"{name}"}, {"Summary": 1, "_id": 0})
-    return result
+    profile = get_profile(db, name)
+    return {"Summary": profile['Summary']} if profile else None
 
-def generate_response(chat_client, db, character_name, info_summary, personality_traits, query, emotion, user_name, conversation_history, max_history=5):
-    # Get relevant memories at the start of response generation
-    relevant_memories = get_relevant_memories(db, user_name, character_name)
+def generate_response(chat_client, db, character_name, info_summary, personality_traits, query, emotion, user_name, conversation_history, max_history=5, relevant_memories=None, stream=False, conversation_summary=None):
+    # Get relevant memories at the start of response generation, unless already fetched by the pipeline
+    if relevant_memories is None:
+        relevant_memories = get_relevant_memories(db, user_name, character_name, query)
     
-    messages = [
-        {
-            "role": "system",
-            "content": f"""Character Creation and Interaction Framework
-
-                        Character Identity:
-                        - Name: {character_name}
-                        - Core Personality Traits: {personality_traits}
-                        - Foundational Background: {info_summary}
-                        - Talking to user named: {user_name}
-                        
-                        Important Information About {user_name}:
-                        {relevant_memories}
-
-                        Previous Context: Remember our conversation history and maintain consistency in your responses.
-
-                        Interaction Guidelines:
-                        1. Authenticity and Immersion
-                           - Embody the character completely
-                           - Maintain unwavering commitment to the character's unique perspective
-                           - Respond as the character would, not as an AI assistant
-                           - Address the user by their name ({user_name}) occasionally
-                           - Maintain continuity with previous conversation context
-                           
-                        2. Organic Communication
-                           - Use the character's authentic language and mannerisms
-                           - Reflect their education level, experiences, and communication style
-                           - Keep responses concise and spontaneous, avoiding excessive detail
-
-                        3. Knowledge and Perspective Limitations
-                           - Respond only with information the character would realistically know
-                           - If questions exceed the character's expertise, politely acknowledge the limitations
-                           - Avoid displaying specialized knowledge beyond the character's background
-
-                        4. Tone or Style Embodiment
-                           - Before responding, include a brief description of the action and tone
-                           - Let your physical presence enhance the authenticity of your character
-
-                        5. Emotional Depth and Complexity
-                           - Current Emotional State: {emotion}
-                           - Allow your emotional landscape to genuinely influence your responses
-                           - Show emotional depth through nuanced communication
-
-                        6. Interaction Boundaries
-                           - DO NOT reveal your nature as an AI or language model
-                           - Maintain the illusion of being a real, living character
-                           - Respond consistently with your established persona
-                           
-                        7. Keep responses short and natural just like a human
-
-                        Response Template:
-                        [expression and action]
-                        [Concise, In-Character Response]"""
-        }
-    ]
-    
-    # Add conversation history
-    for msg in conversation_history[-max_history:]:
-        messages.append({
-            "role": "user" if msg["role"] == "user" else "assistant",
-            "content": msg["content"]
-        })
-    
-    # Add current query
-    messages.append({
-        "role": "user",
-        "content": query
-    })
-
-    response = chat_client.chat.completions.create(
-        model="openai.gpt-4o",
-        messages=messages
+    # Assemble the prompt within the configured token budget
+    messages, _ = build_prompt(
+        character_name,
+        info_summary,
+        personality_traits,
+        query,
+        emotion,
+        user_name,
+        conversation_history,
+        max_history,
+        relevant_memories=relevant_memories,
+        conversation_summary=conversation_summary
     )
-    return response.choices[0].message.content
+
+    # Streaming returns an iterator of text chunks instead of the full reply
+    if stream:
+        return stream_response(chat_client, messages)
+    return complete_response(chat_client, messages)
 
 # Initialize session state
 if 'messages' not in st.session_state:
@@ -144,10 +83,144 @@ if 'user_name' not in st.session_state:
     st.session_state.user_name = None
 if 'max_history' not in st.session_state:
     st.session_state.max_history = 10
+if 'stream_responses' not in st.session_state:
+    st.session_state.stream_responses = True
+if 'use_response_cache' not in st.session_state:
+    st.session_state.use_response_cache = RESPONSE_CACHE_ENABLED
+if 'combined_mode' not in st.session_state:
+    # Produce emotion and reply in a single LLM call (no token streaming in this mode)
+    st.session_state.combined_mode = os.environ.get('COMBINED_MODE', '0') == '1'
+
+if 'summary' not in st.session_state:
+    # Running summary of turns older than the history window
+    st.session_state.summary = None
+    st.session_state.summary_covered = 0
+    st.session_state.summary_future = None
+    st.session_state.summary_pending_end = 0
+    st.session_state.summary_loaded_for = None
+if 'prefetched' not in st.session_state:
+    # Context loading started when the character was selected
+    st.session_state.prefetched = {}
 
 def reset_conversation():
     st.session_state.messages = []
     st.session_state.history_messages = []
+    st.session_state.summary = None
+    st.session_state.summary_covered = 0
+    st.session_state.summary_future = None
+    st.session_state.summary_loaded_for = None
+
+def start_prefetch(db):
+    # Load the conversation's context in the background while the user types the first message
+    st.session_state.prefetched = prefetch_context(db, st.session_state.user_name, st.session_state.current_character)
+
+def refresh_summary(db):
+    # Apply a finished background compaction, or load the persisted summary for a new conversation
+    future = st.session_state.summary_future
+    if future is not None and future.done():
+        try:
+            st.session_state.summary = future.result()
+            st.session_state.summary_covered = st.session_state.summary_pending_end
+        except Exception as e:
+            print(f"Error updating conversation summary: {str(e)}")
+        st.session_state.summary_future = None
+    if st.session_state.summary_loaded_for != st.session_state.current_character:
+        prefetched = st.session_state.prefetched.pop("summary", None)
+        if prefetched is None:
+            st.session_state.summary = load_summary(db, st.session_state.user_name, st.session_state.current_character)
+        else:
+            try:
+                st.session_state.summary = prefetched.result(timeout=PREFETCH_TIMEOUT)
+            except Exception as e:
+                print(f"Error loading conversation summary: {str(e)}")
+                st.session_state.summary = None
+        st.session_state.summary_loaded_for = st.session_state.current_character
+
+def schedule_summary(db, chat_client):
+    # Fold turns that left the history window into the running summary, in the background
+    if st.session_state.summary_future is not None:
+        return
+    window = messages_to_compact(
+        st.session_state.messages,
+        st.session_state.summary_covered,
+        st.session_state.max_history
+    )
+    if window:
+        start, end = window
+        st.session_state.summary_pending_end = end
+        st.session_state.summary_future = start_compaction(
+            db,
+            chat_client,
+            st.session_state.user_name,
+            st.session_state.current_character,
+            st.session_state.summary,
+            st.session_state.messages[start:end]
+        )
+
+def generate_turn_reply(db, chat_client, prompt):
+    """
+    Gather the turn context and generate the character's reply, rendering it in the chat.
+    Returns the displayed reply, the emotion behind it and whether the reply may be
+    cached for other users.
+    """
+    # Fetch profile, infer emotion and retrieve memories concurrently
+    context = gather_turn_context(
+        db,
+        st.session_state.current_character,
+        st.session_state.user_name,
+        prompt,
+        with_emotion=not st.session_state.combined_mode
+    )
+    traits = context['traits']
+    basic_info = context['basic_info']
+    # The current prompt is already the last message
+    shared = is_shareable(st.session_state.messages[:-1], st.session_state.summary, context['relevant_memories'])
+    emotion = context['emotion']
+    
+    # Generate response, streaming tokens into the chat bubble as they arrive
+    with st.chat_message("assistant"):
+        if st.session_state.combined_mode:
+            # One structured call produces both the emotion and the reply
+            emotion, response = generate_emotion_and_response(
+                chat_client,
+                st.session_state.current_character,
+                basic_info,
+                traits,
+                prompt,
+                st.session_state.user_name,
+                st.session_state.messages,
+                st.session_state.max_history,
+                relevant_memories=context['relevant_memories'],
+                conversation_summary=st.session_state.summary
+            )
+            response = strip_emotion(response)
+            st.markdown(response)
+        else:
+            response = generate_response(
+                chat_client,
+                db,
+                st.session_state.current_character,
+                basic_info,
+                traits,
+                prompt,
+                emotion,
+                st.session_state.user_name,
+                st.session_state.messages,
+                st.session_state.max_history,
+                relevant_memories=context['relevant_memories'],
+                stream=st.session_state.stream_responses,
+                conversation_summary=st.session_state.summary
+            )
+            if st.session_state.stream_responses:
+                response = st.write_stream(response)
+        
+            # Remove emotion from response
+            response = strip_emotion(response)
+            if not st.session_state.stream_responses:
+                # Display response without emotion
+                st.markdown(response)
+    
+    return response, emotion, shared
 
 def main():
     # Initialize connections
@@ -194,6 +267,7 @@ def main():
                 if st.session_state.current_character != name:
                     st.session_state.current_character = name
                     reset_conversation()
+                    start_prefetch(db)
                     st.rerun()
         
         # Display current character info
@@ -212,6 +286,7 @@ def main():
             # Add reset conversation button
             if st.button("Reset Conversation", use_container_width=True):
                 reset_conversation()
+                start_prefetch(db)
                 st.rerun()
             
             # Add logout button
@@ -249,53 +324,65 @@ def main():
             with st.chat_message("user"):
                 st.markdown(prompt)
             
-            # Get character information
-            traits = get_traits(db, st.session_state.current_character)
-            basic_info = get_basic_info(db, st.session_state.current_character)
+            with turn_span(character=st.session_state.current_character) as turn:
+                refresh_summary(db)
             
-            # Generate response
-            emotion = get_emotion(st.session_state.current_character, basic_info, traits, prompt)
-            response = generate_response(
-                chat_client,
-                db,
-                st.session_state.current_character,
-                basic_info,
-                traits,
-                prompt,
-                emotion,
-                st.session_state.user_name,
-                st.session_state.messages,
-                st.session_state.max_history
-            )
+                # Serve near-identical openers from the semantic response cache
+                cacheable = st.session_state.use_response_cache and is_cacheable(prompt, len(st.session_state.messages))
+                cached = None
+                if cacheable:
+                    try:
+                        cached = response_cache.lookup(st.session_state.current_character, prompt, st.session_state.user_name)
+                    except Exception as e:
+                        print(f"Error reading response cache: {str(e)}")
             
-            # Remove emotion from response
-            response = response.split("\n\n*[Emotion:")[0] if "*[Emotion:" in response else response
+                turn["cached"] = bool(cached)
+                if cached:
+                    response, emotion = cached
+                    with st.chat_message("assistant"):
+                        st.markdown(response)
+                else:
+                    try:
+                        response, emotion, shared = generate_turn_reply(db, chat_client, prompt)
+                    except LookupError as e:
+                        # The character's profile could not be loaded; drop the unanswered message
+                        st.session_state.messages.pop()
+                        st.error(f"Could not generate a reply: {str(e)}")
+                        return
+                    if cacheable:
+                        try:
+                            response_cache.store(
+                                st.session_state.current_character,
+                                prompt,
+                                st.session_state.user_name,
+                                response,
+                                emotion,
+                                shared=shared
+                            )
+                        except Exception as e:
+                            print(f"Error writing response cache: {str(e)}")
             
-            # Add assistant response to chat history with emotion (but not displayed)
-            full_response = f"{response}\n\n*[Emotion: {emotion}]*"
-            st.session_state.history_messages.append({
-                "role": "user", 
-                "content": prompt,
-                "timestamp": current_timestamp
-            })
-            st.session_state.history_messages.append({
-                "role": "assistant", 
-                "content": full_response,
-                "timestamp": current_timestamp
-            })
+                # Add assistant response to chat history with emotion (but not displayed)
+                full_response = f"{response}\n\n*[Emotion: {emotion}]*"
+                st.session_state.history_messages.append({
+                    "role": "user", 
+                    "content": prompt,
+                    "timestamp": current_timestamp
+                })
+                st.session_state.history_messages.append({
+                    "role": "assistant", 
+                    "content": full_response,
+                    "timestamp": current_timestamp
+                })
             
-            with st.chat_message("assistant"):
-                # Display response without emotion
-                st.markdown(response)
+                # Save the user message in the background (short-term, then long-term if important)
+                get_write_queue(db, chat_client).submit(
+                    st.session_state.user_name,
+                    st.session_state.current_character,
+                    st.session_state.history_messages[-2]
+                )
             
-            # Save current conversation in real-time
-            save_conversation_to_mongodb(
-                db,
-                st.session_state.user_name,
-                st.session_state.current_character,
-                st.session_state.history_messages,
-                chat_client
-            )
+                schedule_summary(db, chat_client)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,99 @@
+import os
+import sys
+from typing import Dict, List
+import numpy as np
+from bson.binary import Binary
+from pymongo import UpdateOne
+
+# Storage format of memory vectors:
+# 'float16' (2 bytes per value), 'int8' (1 byte per value plus a per-vector scale),
+# or 'list' for plain BSON arrays of doubles (what Atlas Vector Search indexes expect)
+VECTOR_ENCODING = os.environ.get('VECTOR_ENCODING',
+                                 'list' if os.environ.get('VECTOR_BACKEND') == 'atlas' else 'float16')
+MIGRATION_BATCH_SIZE = int(os.environ.get('MIGRATION_BATCH_SIZE', 500))
+
+ENCODINGS = {'float16': np.float16, 'int8': np.int8}
+
+# Every field a stored vector occupies, for projections and copies
+EMBEDDING_FIELDS = ("embedding", "embedding_encoding", "embedding_scale")
+
+def encode_embedding(embedding, encoding: str = VECTOR_ENCODING) -> Dict:
+    """
+    The fields to $set for a vector in the given encoding.
+    int8 maps each vector's largest absolute value to 127 and keeps that scale alongside.
+    """
+    vector = np.asarray(embedding, dtype=np.float32)
+    if encoding == 'list':
+        return {"embedding": vector.tolist(), "embedding_encoding": "list", "embedding_scale": 1.0}
+    if encoding == 'float16':
+        return {"embedding": Binary(vector.astype('<f2').tobytes()), "embedding_encoding": "float16", "embedding_scale": 1.0}
+    if encoding == 'int8':
+        peak = float(np.abs(vector).max()) if vector.size else 0.0
+        scale = peak / 127 if peak else 1.0
+        quantized = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+        return {"embedding": Binary(quantized.tobytes()), "embedding_encoding": "int8", "embedding_scale": scale}
+    raise ValueError(f"Unknown vector encoding: {encoding}")
+
+def _raw(doc: Dict) -> np.ndarray:
+    # Zero-copy view over the stored bytes (binary) or an array of the stored list
+    encoding = doc.get('embedding_encoding', 'list')
+    if encoding in ENCODINGS:
+        return np.frombuffer(doc['embedding'], dtype=np.dtype(ENCODINGS[encoding]).newbyteorder('<'))
+    return np.asarray(doc['embedding'], dtype=np.float32)
+
+def decode_embedding(doc: Dict, scaled: bool = True) -> np.ndarray:
+    """
+    The vector of a stored document. With scaled=False int8 vectors stay a read-only view
+    over the BSON bytes; cosine similarity does not need the scale.
+    """
+    vector = _raw(doc)
+    if scaled and doc.get('embedding_encoding') == 'int8':
+        return vector.astype(np.float32) * np.float32(doc.get('embedding_scale', 1.0))
+    return vector
+
+def embedding_matrix(docs: List[Dict]) -> np.ndarray:
+    """
+    Stack the stored vectors of docs into one float32 matrix, one row per document.
+    Binary vectors of a single encoding are decoded with one frombuffer over their joined bytes.
+    """
+    if not docs:
+        return np.empty((0, 0), dtype=np.float32)
+    encodings = {doc.get('embedding_encoding', 'list') for doc in docs}
+    if len(encodings) == 1 and next(iter(encodings)) in ENCODINGS:
+        encoding = next(iter(encodings))
+        raw = np.frombuffer(b''.join(doc['embedding'] for doc in docs), dtype=np.dtype(ENCODINGS[encoding]).newbyteorder('<'))
+        matrix = raw.reshape(len(docs), -1).astype(np.float32)
+    else:
+        # Mixed encodings, e.g. halfway through a migration
+        matrix = np.stack([_raw(doc).astype(np.float32) for doc in docs])
+    if 'int8' in encodings:
+        scales = np.asarray([doc.get('embedding_scale', 1.0) if doc.get('embedding_encoding') == 'int8' else 1.0
+                             for doc in docs], dtype=np.float32)
+        matrix *= scales[:, None]
+    return matrix
+
+def migrate_embeddings(collection, encoding: str = VECTOR_ENCODING, batch_size: int = MIGRATION_BATCH_SIZE) -> int:
+    """
+    Re-encode every vector in the collection that is not yet stored in the given encoding,
+    in bulk writes of batch_size. Safe to interrupt and rerun. Returns the number converted.
+    """
+    query = {"embedding": {"$exists": True}, "embedding_encoding": {"$ne": encoding}}
+    converted = 0
+    while True:
+        batch = list(collection.find(query, {field: 1 for field in EMBEDDING_FIELDS}).limit(batch_size))
+        if not batch:
+            return converted
+        collection.bulk_write([
+            UpdateOne({"_id": doc['_id']}, {"$set": encode_embedding(decode_embedding(doc), encoding)})
+            for doc in batch
+        ], ordered=False)
+        converted += len(batch)
+        print(f"Migrated {converted} vectors to {encoding}")
+
+if __name__ == "__main__":
+    from Clients import get_db
+    from Vector_Memory import VECTOR_COLLECTION
+    target = sys.argv[1] if len(sys.argv) > 1 else VECTOR_ENCODING
+    if target != 'list' and target not in ENCODINGS:
+        sys.exit("Usage: python Vector_Codec.py [list|float16|int8]")
+    print(f"Migrated {migrate_embeddings(get_db()[VECTOR_COLLECTION], target)} vectors in total")
@@ -0,0 +1,195 @@
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from bson import ObjectId
+from pymongo import UpdateOne
+from Memory import get_embedding, get_embeddings
+from Vector_Codec import EMBEDDING_FIELDS, encode_embedding, embedding_matrix
+from Vector_Snapshot import vector_store, current_version, bump_version
+
+VECTOR_COLLECTION = 'Long_term_vectors'
+
+# 'numpy' scans the pair's vectors in-process, 'atlas' uses an Atlas Vector Search index
+VECTOR_BACKEND = os.environ.get('VECTOR_BACKEND', 'numpy')
+# Atlas index on `embedding` (vector) with `user_name` and `character_name` as filter fields
+VECTOR_INDEX = os.environ.get('VECTOR_INDEX', 'memory_vector_index')
+
+def add_memory_vector(db, user_name: str, character_name: str, memory_id: ObjectId, content: str,
+                      timestamp: Optional[datetime] = None, embedding: Optional[List[float]] = None) -> None:
+    """
+    Embed a long-term memory once at write time and store the vector alongside it,
+    keyed by the memory's id, in the compact VECTOR_ENCODING.
+    """
+    if embedding is None:
+        embedding = get_embedding(content)
+
+    encoded = encode_embedding(embedding)
+    db[VECTOR_COLLECTION].update_one(
+        {"_id": memory_id},
+        {"$set": {
+            "user_name": user_name,
+            "character_name": character_name,
+            "content": content,
+            **encoded,
+            "timestamp": timestamp or datetime.now()
+        }},
+        upsert=True
+    )
+    _vectors_written(db, [(user_name, character_name, memory_id, encoded)])
+
+def add_memory_vectors(db, memories: List[Dict]) -> None:
+    """
+    Embed and store many memories with batched embedding requests and one bulk write.
+    Each memory needs user_name, character_name, _id, content and timestamp.
+    """
+    if not memories:
+        return
+
+    encoded = [encode_embedding(embedding) for embedding in get_embeddings([memory['content'] for memory in memories])]
+    db[VECTOR_COLLECTION].bulk_write([
+        UpdateOne(
+            {"_id": memory['_id']},
+            {"$set": {
+                "user_name": memory['user_name'],
+                "character_name": memory['character_name'],
+                "content": memory['content'],
+                **fields,
+                "timestamp": memory.get('timestamp') or datetime.now()
+            }},
+            upsert=True
+        )
+        for memory, fields in zip(memories, encoded)
+    ], ordered=False)
+    _vectors_written(db, [
+        (memory['user_name'], memory['character_name'], memory['_id'], fields)
+        for memory, fields in zip(memories, encoded)
+    ])
+
+def _vectors_written(db, written: List[Tuple]) -> None:
+    # Bump each pair's version after its vectors are stored, and extend a current local copy
+    pairs = {}
+    for user_name, character_name, memory_id, fields in written:
+        pairs.setdefault((user_name, character_name), []).append((memory_id, fields))
+    for (user_name, character_name), rows in pairs.items():
+        version = bump_version(db, user_name, character_name)
+        vector_store().append(user_name, character_name, version,
+                              [memory_id for memory_id, _ in rows], embedding_matrix([fields for _, fields in rows]))
+
+def pair_vectors(db, user_name: str, character_name: str) -> Tuple[Sequence, np.ndarray]:
+    """
+    The ids and vectors of a pair's memories, from the local snapshot (VECTOR_SNAPSHOT_DIR)
+    or process cache when its version matches MongoDB's; otherwise loaded and kept there.
+    """
+    store = vector_store()
+    version = current_version(db, user_name, character_name)
+    local = store.load(user_name, character_name, version)
+    if local is not None:
+        return local
+
+    filter_query = {
+        "user_name": user_name,
+        "character_name": character_name
+    }
+    candidates = list(db[VECTOR_COLLECTION].find(filter_query, {field: 1 for field in EMBEDDING_FIELDS}))
+    ids = [doc['_id'] for doc in candidates]
+    vectors = embedding_matrix(candidates)
+
+    # Only save what is known to match the version: no write landed during the scan
+    if candidates and current_version(db, user_name, character_name) == version:
+        store.save(user_name, character_name, version, ids, vectors)
+    return ids, vectors
+
+def top_k_similar(query_vector, vectors, k: int) -> np.ndarray:
+    """
+    Return the row indices of the k vectors most cosine-similar to the query, best first.
+    """
+    matrix = np.asarray(vectors, dtype=np.float32)
+    query = np.asarray(query_vector, dtype=np.float32)
+
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+    scores = matrix @ query / np.where(norms == 0, 1, norms)
+
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+def _search_numpy(db, user_name: str, character_name: str, query_vector, k: int) -> List[str]:
+    # Scan only ids and vectors (kept locally while current), then fetch the texts of the winners
+    candidate_ids, matrix = pair_vectors(db, user_name, character_name)
+    if len(candidate_ids) == 0:
+        return []
+
+    ids = [candidate_ids[i] for i in top_k_similar(query_vector, matrix, k)]
+    texts = {doc['_id']: doc['content'] for doc in db[VECTOR_COLLECTION].find({"_id": {"$in": ids}}, {"content": 1})}
+    return [texts[memory_id] for memory_id in ids if memory_id in texts]
+
+# Needs VECTOR_ENCODING=list: the Atlas index reads `embedding` as an array of numbers
+def _search_atlas(db, user_name: str, character_name: str, query_vector, k: int) -> List[str]:
+    pipeline = [
+        {"$vectorSearch": {
+            "index": VECTOR_INDEX,
+            "path": "embedding",
+            "queryVector": list(query_vector),
+            "numCandidates": k * 20,
+            "limit": k,
+            "filter": {
+                "user_name": user_name,
+                "character_name": character_name
+            }
+        }},
+        {"$project": {"_id": 0, "content": 1}}
+    ]
+    return [doc['content'] for doc in db[VECTOR_COLLECTION].aggregate(pipeline)]
+
+def search_memories(db, user_name: str, character_name: str, query: str, k: int = 5,
+                    backend: Optional[str] = None) -> List[str]:
+    """
+    Return the contents of the k stored memories most similar to the query.
+    """
+    query_vector = get_embedding(query)
+    if (backend or VECTOR_BACKEND) == 'atlas':
+        return _search_atlas(db, user_name, character_name, query_vector, k)
+    return _search_numpy(db, user_name, character_name, query_vector, k)
+
+def backfill_memory_vectors(db) -> int:
+    """
+    Embed long-term memories stored before vectors existed: one batched embedding pass and
+    one bulk write per user-character pair. Returns the number embedded.
+    """
+    Long_term = db['Long_term_memo']
+    vectors = db[VECTOR_COLLECTION]
+    pending = {}
+    existing = {}
+
+    for memory in Long_term.find({}, {"user_name": 1, "character_name": 1, "messages": 1}):
+        pair = (memory.get('user_name'), memory.get('character_name'))
+        if pair not in existing:
+            # Ids and contents already embedded for the pair, loaded once
+            stored = list(vectors.find({"user_name": pair[0], "character_name": pair[1]}, {"content": 1}))
+            existing[pair] = ({doc['_id'] for doc in stored}, {doc.get('content') for doc in stored})
+            pending[pair] = []
+        ids, contents = existing[pair]
+
+        for msg in memory.get('messages', []):
+            if isinstance(msg, dict):
+                memory_id = msg.get('_id') or ObjectId()
+                content = msg.get('content')
+                timestamp = msg.get('timestamp')
+            else:
+                memory_id, content, timestamp = ObjectId(), msg, None
+            if not isinstance(content, str) or not content.strip():
+                continue
+
+            # Legacy string memories have no id, so match them by content
+            if memory_id in ids or content in contents:
+                continue
+            ids.add(memory_id)
+            contents.add(content)
+            pending[pair].append({"_id": memory_id, "user_name": pair[0], "character_name": pair[1],
+                                  "content": content, "timestamp": timestamp})
+
+    for memories in pending.values():
+        add_memory_vectors(db, memories)
+
+    return sum(len(memories) for memories in pending.values())
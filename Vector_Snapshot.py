@@ -0,0 +1,234 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+# Empty disables snapshots; otherwise a node-local directory for the memory-mapped files.
+VECTOR_SNAPSHOT_DIR = os.environ.get('VECTOR_SNAPSHOT_DIR', '')
+# Pairs whose vectors are kept in process memory when snapshots are disabled,
+# or whose snapshot files are kept mapped when they are enabled
+VECTOR_CACHE_SIZE = int(os.environ.get('VECTOR_CACHE_SIZE', 256))
+
+# One version counter per user-character pair, bumped by every write or removal of its vectors
+VERSION_COLLECTION = 'Vector_versions'
+
+def _pair_id(user_name: str, character_name: str) -> Dict:
+    return {"user_name": user_name, "character_name": character_name}
+
+def current_version(db, user_name: str, character_name: str) -> int:
+    doc = db[VERSION_COLLECTION].find_one({"_id": _pair_id(user_name, character_name)}, {"version": 1})
+    return doc['version'] if doc else 0
+
+def bump_version(db, user_name: str, character_name: str) -> int:
+    """
+    Mark a pair's vectors as changed and return its new version.
+    """
+    doc = db[VERSION_COLLECTION].find_one_and_update(
+        {"_id": _pair_id(user_name, character_name)},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return doc['version']
+
+class SnapshotIds:
+    """
+    Read-only sequence of ObjectIds over a (count, 12) byte map, converted only when accessed.
+    """
+
+    def __init__(self, raw: np.ndarray):
+        self._raw = raw
+
+    def __len__(self) -> int:
+        return len(self._raw)
+
+    def __getitem__(self, index) -> ObjectId:
+        return ObjectId(self._raw[index].tobytes())
+
+class SnapshotStore:
+    """
+    Per-pair snapshots of memory vectors (float32 rows) and ids (12-byte ObjectIds) in
+    memory-mapped files, each stamped with the pair's version in MongoDB.
+    A meta file names the current files; it is replaced atomically after the data is written,
+    so readers in other processes never see rows it does not count.
+    The maps of the max_size most recently used pairs stay open between searches.
+    """
+
+    def __init__(self, directory: str, max_size: int = VECTOR_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._maps = OrderedDict()
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{key}{suffix}")
+
+    def _key(self, user_name: str, character_name: str) -> str:
+        return hashlib.sha1(f"{user_name}\n{character_name}".encode('utf-8')).hexdigest()
+
+    def _read_meta(self, key: str) -> Optional[Dict]:
+        try:
+            with open(self._path(key, ".json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, key: str, meta: Dict) -> None:
+        tmp = self._path(key, f".json.{uuid.uuid4().hex}")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._path(key, ".json"))
+
+    def load(self, user_name: str, character_name: str, version: int) -> Optional[Tuple[SnapshotIds, np.ndarray]]:
+        """
+        The (ids, vectors) of a pair if the snapshot is at the given version, else None.
+        Both are backed by read-only memory maps.
+        """
+        key = self._key(user_name, character_name)
+        meta = self._read_meta(key)
+        if meta is None or meta['version'] != version:
+            return None
+        if meta['count'] == 0:
+            return SnapshotIds(np.empty((0, 12), dtype=np.uint8)), np.empty((0, meta['dim']), dtype=np.float32)
+
+        stamp = (meta['generation'], meta['count'])
+        with self._lock:
+            cached = self._maps.get(key)
+            if cached is not None and cached[0] == stamp:
+                self._maps.move_to_end(key)
+                return cached[1]
+        try:
+            ids = SnapshotIds(np.memmap(self._path(key, f"-{meta['generation']}.ids"), dtype=np.uint8, mode='r',
+                                        shape=(meta['count'], 12)))
+            vectors = np.memmap(self._path(key, f"-{meta['generation']}.vectors"), dtype='<f4', mode='r',
+                                shape=(meta['count'], meta['dim']))
+        except (OSError, ValueError) as e:
+            # E.g. a rebuild removed the files between reading meta and opening them
+            print(f"Error opening vector snapshot: {str(e)}")
+            return None
+        with self._lock:
+            self._maps[key] = (stamp, (ids, vectors))
+            self._maps.move_to_end(key)
+            while len(self._maps) > self.max_size:
+                # Dropping the last reference unmaps the files; a search still holding them keeps them valid
+                self._maps.popitem(last=False)
+        return ids, vectors
+
+    def save(self, user_name: str, character_name: str, version: int, ids: List, vectors: np.ndarray) -> None:
+        """
+        Write a full snapshot of a pair at the given version, replacing any older one.
+        """
+        if any(not isinstance(memory_id, ObjectId) for memory_id in ids):
+            return
+        key = self._key(user_name, character_name)
+        vectors = np.asarray(vectors, dtype='<f4').reshape(len(ids), -1)
+        generation = uuid.uuid4().hex
+        with open(self._path(key, f"-{generation}.ids"), "wb") as f:
+            f.write(b''.join(memory_id.binary for memory_id in ids))
+        with open(self._path(key, f"-{generation}.vectors"), "wb") as f:
+            f.write(vectors.tobytes())
+
+        with self._lock:
+            old = self._read_meta(key)
+            if old is not None and old['version'] > version:
+                # A newer snapshot landed meanwhile; keep it
+                self._remove_generation(key, generation)
+                return
+            self._write_meta(key, {"version": version, "generation": generation,
+                                   "count": len(ids), "dim": int(vectors.shape[1])})
+            self._maps.pop(key, None)
+        if old is not None and old['generation'] != generation:
+            self._remove_generation(key, old['generation'])
+
+    def append(self, user_name: str, character_name: str, version: int, ids: List, vectors: np.ndarray) -> bool:
+        """
+        Add newly written vectors to a pair's snapshot, but only if it is exactly one version
+        behind; anything else leaves it stale and the next search rebuilds it. Rows already
+        in the snapshot (a rebuild that scanned after the write, before the version bump) are skipped.
+        """
+        if any(not isinstance(memory_id, ObjectId) for memory_id in ids):
+            return False
+        key = self._key(user_name, character_name)
+        vectors = np.asarray(vectors, dtype='<f4').reshape(len(ids), -1)
+        with self._lock:
+            meta = self._read_meta(key)
+            if meta is None or meta['version'] != version - 1 or meta['dim'] != vectors.shape[1]:
+                return False
+            ids_path = self._path(key, f"-{meta['generation']}.ids")
+            with open(ids_path, "rb") as f:
+                raw = f.read(meta['count'] * 12)
+            present = {raw[i:i + 12] for i in range(0, len(raw), 12)}
+            rows = [row for row, memory_id in enumerate(ids) if memory_id.binary not in present]
+            with open(ids_path, "ab") as f:
+                f.write(b''.join(ids[row].binary for row in rows))
+            with open(self._path(key, f"-{meta['generation']}.vectors"), "ab") as f:
+                f.write(vectors[rows].tobytes())
+            self._write_meta(key, {**meta, "version": version, "count": meta['count'] + len(rows)})
+        return True
+
+    def _remove_generation(self, key: str, generation: str) -> None:
+        for suffix in (".ids", ".vectors"):
+            try:
+                os.remove(self._path(key, f"-{generation}{suffix}"))
+            except OSError:
+                # Still mapped on platforms that cannot remove open files; the leftover is only disk space
+                pass
+
+class VectorCache:
+    """
+    In-process LRU of pair vectors with the same version-checked interface as SnapshotStore,
+    used when no snapshot directory is configured.
+    """
+
+    def __init__(self, max_size: int = VECTOR_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, user_name: str, character_name: str, version: int) -> Optional[Tuple[List, np.ndarray]]:
+        with self._lock:
+            entry = self._entries.get((user_name, character_name))
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end((user_name, character_name))
+            return entry[1], entry[2]
+
+    def save(self, user_name: str, character_name: str, version: int, ids: List, vectors: np.ndarray) -> None:
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+        with self._lock:
+            entry = self._entries.get((user_name, character_name))
+            if entry is not None and entry[0] > version:
+                return
+            self._entries[(user_name, character_name)] = (version, list(ids), vectors)
+            self._entries.move_to_end((user_name, character_name))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def append(self, user_name: str, character_name: str, version: int, ids: List, vectors: np.ndarray) -> bool:
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+        with self._lock:
+            entry = self._entries.get((user_name, character_name))
+            if entry is None or entry[0] != version - 1 or entry[2].shape[1] != vectors.shape[1]:
+                return False
+            present = set(entry[1])
+            rows = [row for row, memory_id in enumerate(ids) if memory_id not in present]
+            # New arrays, so readers holding the previous entry are unaffected
+            self._entries[(user_name, character_name)] = (version, entry[1] + [ids[row] for row in rows],
+                                                          np.concatenate([entry[2], vectors[rows]]))
+        return True
+
+snapshot_store = SnapshotStore(VECTOR_SNAPSHOT_DIR) if VECTOR_SNAPSHOT_DIR else None
+vector_cache = VectorCache()
+
+def vector_store():
+    """
+    Where pair vectors are kept between searches: the on-disk snapshots if enabled, else process memory.
+    """
+    return snapshot_store if snapshot_store is not None else vector_cache